@@ -1,5 +1,12 @@
+import argparse
+import csv
+import glob
+import multiprocessing
 import numpy as np
+import os
+from os import path
 import cv2, sys
+import detector
 
 # Width/Height constants are used only for debugging. Constants define the 
 # output window which will be displayed to the user.
@@ -29,83 +36,57 @@ B_UPPER = 150
 DOS_MIN_SIZE = 300
 DOS_MAX_SIZE = 350
 
+# Batch mode: file extensions picked up from directories, and the summary file written into the output
+# directory, with a row per image.
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"]
+SUMMARY_FILE = "dosimeter_summary.csv"
+
+# Returns the detector limits (see detector.makeLimits) from the size and colour constants above.
+def detectorLimits():
+    return detector.makeLimits(DOS_MIN_SIZE, DOS_MAX_SIZE, (R_LOWER, G_LOWER, B_LOWER), (R_UPPER, G_UPPER, B_UPPER),
+        X_OFF, Y_OFF, NUM_SAMPLES)
+
 # Boolean function which returns whether or not the region enclosing a contour is
 # the dosimeter. The function will sample several points inside of the region to 
 # verify the sample points are within the expected dosimeter values; if so the dosimeter is there.
-
-# WARNING:
-# There may be sampling issues, which will cause an array out of bounds exception, as the contours get smaller.
-# If a region is 10x10 pixels, it will be impossible to probe the RGB values. However, it is incredibly
-# unlikely the dosimeter will not be found. Since the size of the dosimeter is checked first, this error
-# should not occur. More testing will be required to determine reliability.
+# Samples which fall outside of the region reject it.
 def isDosimeter(ROI):
-
-    # Find the center of the image
-    mid_x = ROI.shape[0] // 2
-    mid_y = ROI.shape[1] // 2
-    average = 0
-
-    # One sample will occur in each quadrant, as well as the center of the image.
-    x_cord = [mid_x, mid_x + X_OFF, mid_x + X_OFF, mid_x - X_OFF, mid_x - X_OFF]
-    y_cord = [mid_y, mid_y + Y_OFF, mid_y - Y_OFF, mid_y + Y_OFF, mid_y - Y_OFF]
-
-    for i in range(NUM_SAMPLES):
-        b,g,r = ROI[x_cord[i], y_cord[i]] # Extract r,b,g values
-        # print(r, g, b)
-
-        # There is likely a better implementation, but this works for now.
-        if (R_LOWER < r < R_UPPER):
-            if (G_LOWER < g < G_UPPER):
-                if (B_LOWER < b < B_UPPER):
-                    average += 1
-    
-    # If half of the samples are valid, the region is likely the dosimeter.
-    if (average > (NUM_SAMPLES // 2)):
-        return True
-
-    return False
+    box = (0, 0, ROI.shape[1], ROI.shape[0])
+    return bool(detector.colourTest(ROI, [box], detectorLimits())[0])
 
 # Boolean function which determines if a region is approximately the size of the dosimeter.
 # The expected size will be within the DOS_MIN_SIZE and DOS_MAX_SIZE squared.
 def in_size(ROI):
-    width, height,_ = ROI.shape # Extract region parameters
-    if (DOS_MIN_SIZE <= width <= DOS_MAX_SIZE):
-        if (DOS_MIN_SIZE <= height <= DOS_MAX_SIZE):
-            return True
-    return False
-
-# Usage: python3 Process_Frame.py <insert filename>
-# The code below has been designed to be used within a script, hence the abstraction.
-def main(file_path):
+    box = (0, 0, ROI.shape[1], ROI.shape[0])
+    return bool(detector.sizeTest([box], detectorLimits())[0])
+
+# Returns the (r, g, b) reading of a cropped dosimeter region: the average of the samples taken at its
+# center and in its four quadrants, at the same points as the colour check.
+def readColour(ROI):
+    limits = detectorLimits()
+    h, w = ROI.shape[:2]
+    rows = h // 2 + np.array([0, X_OFF, X_OFF, -X_OFF, -X_OFF])[:limits["samples"]]
+    cols = w // 2 + np.array([0, Y_OFF, -Y_OFF, Y_OFF, -Y_OFF])[:limits["samples"]]
+    b, g, r = ROI[np.clip(rows, 0, h - 1), np.clip(cols, 0, w - 1)].mean(axis=0)
+    return int(round(r)), int(round(g)), int(round(b))
+
+# Searches an image for the dosimeter. Returns a result holding the image name, the (x, y, w, h) box of the
+# dosimeter, its cropped region ("crop", a view into the image) and its (r, g, b) reading; "status" is "ok",
+# or tells why there is no crop.
+def analyseImage(file_path):
+    result = {"image": file_path, "status": "ok", "box": None, "crop": None, "rgb": None}
+
     # Read the frame into memory.
     frame = cv2.imread(file_path, cv2.IMREAD_COLOR)
 
     # Verify frame has been correctly read.
     if (frame is None):
-        print("Invalid file path for sample image.")
-        sys.exit(0)
-
-    # Convert the original image into grayscale, and apply OTSU filtering to it.
-    frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    _, threshold = cv2.threshold(frame_gray, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)
-
-    # Find the contours within the image.
-    contours,_ = cv2.findContours(threshold, cv2.RETR_TREE,cv2.CHAIN_APPROX_SIMPLE)
-
-    # Sort the contours based on area; returns a list with descending contour areas.
-    # The dosimeter is likely within the first 5, potentially 10, contours.
-    contours = sorted(contours, key=cv2.contourArea, reverse=True)
+        print("Invalid file path for sample image: " + file_path)
+        result["status"] = "unreadable"
+        return result
 
-    # Loop through all the contours to find the dosimeter.
-    found_contour = False
-    for c in contours:
-        # Extract the region enclosing a specific contour.
-        x,y,w,h = cv2.boundingRect(c)
-        ROI = frame[y : y + h, x : x + w]
-
-        if in_size(ROI) and isDosimeter(ROI):
-            found_contour = True
-            break
+    # Find the regions which pass the size and colour checks, largest first.
+    boxes = detector.findCandidates(frame, detectorLimits())
 
     # # Display the cropped region to the user. Uncomment this block to display
     # # the dosimeter region to the user.
@@ -116,11 +97,114 @@ def main(file_path):
     # cv2.destroyAllWindows()
 
     # Print an error to the console if no dosimeter is found.
-    if (found_contour == False):
-        print("No dosimeter found in frame: " + sys.argv[1])
-        sys.exit(0)
-
-    cv2.imwrite("Cropped_Dosimeter.jpg", ROI)
-
+    if not boxes:
+        print("No dosimeter found in frame: " + file_path)
+        result["status"] = "dosimeter not found"
+        return result
+
+    # The dosimeter is the largest of them.
+    x,y,w,h = boxes[0]
+    ROI = frame[y : y + h, x : x + w]
+    result.update(box=boxes[0], crop=ROI, rgb=readColour(ROI))
+    return result
+
+# Returns the name of the cropped image of each image, <image name>_cropped.jpg. Images of the same name
+# (e.g. from different directories) are told apart with a number, in the order they are given.
+def cropNames(images):
+    names = []
+    used = set()
+    for image in images:
+        stem = path.splitext(path.basename(image))[0]
+        name = stem + "_cropped.jpg"
+        count = 2
+        while name in used:
+            name = "{}_{}_cropped.jpg".format(stem, count)
+            count += 1
+        used.add(name)
+        names.append(name)
+    return names
+
+# Process pool task: analyses an image and writes its crop into "output" (unless it is None).
+# The cropped region is only returned with "keep_crop", so that it is not sent between processes for nothing.
+def imageTask(task):
+    file_path, output, keep_crop = task
+    result = analyseImage(file_path)
+    result["output"] = None
+    if result["crop"] is not None and output is not None:
+        cv2.imwrite(output, result["crop"])
+        result["output"] = output
+    if keep_crop and result["crop"] is not None:
+        result["crop"] = result["crop"].copy()
+    else:
+        result["crop"] = None
+    return result
+
+# Expands the command line arguments (files, directories or glob patterns) into a sorted list of images.
+def findImages(arguments):
+    images = []
+    for argument in arguments:
+        if path.isdir(argument):
+            for name in sorted(os.listdir(argument)):
+                if path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                    images.append(path.join(argument, name))
+        elif path.exists(argument):
+            images.append(argument)
+        else:
+            images.extend(sorted(glob.glob(argument)))
+    return images
+
+# Writes a row per image to the summary file: whether the dosimeter was found, its box, its reading and
+# the name of its cropped image.
+def writeSummary(filename, results):
+    with open(filename, "w", newline="") as summary_file:
+        writer = csv.writer(summary_file)
+        writer.writerow(["Image", "Status", "X", "Y", "Width", "Height", "R", "G", "B", "Crop"])
+        for result in results:
+            box = result["box"] or ("", "", "", "")
+            rgb = result["rgb"] or ("", "", "")
+            writer.writerow([result["image"], result["status"], *box, *rgb, result["output"] or ""])
+
+# Analyses several images in a pool of "workers" processes and writes their crops and the summary file into
+# "output_dir" (None writes nothing). Returns the results of analyseImage, in the order the images were given,
+# with the name of each written crop in "output"; the cropped regions themselves are kept with "keep_crops".
+def processImages(images, output_dir=".", workers=1, keep_crops=False):
+    outputs = [None] * len(images)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        outputs = [path.join(output_dir, name) for name in cropNames(images)]
+    tasks = [(image, output, keep_crops) for image, output in zip(images, outputs)]
+
+    if workers > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(workers) as pool:
+            results = list(pool.imap(imageTask, tasks, chunksize=4))
+    else:
+        results = [imageTask(task) for task in tasks]
+
+    if output_dir is not None:
+        writeSummary(path.join(output_dir, SUMMARY_FILE), results)
+    return results
+
+# Analyses a single image and writes its crop into "output_dir". Returns the result of analyseImage.
+def main(file_path, output_dir="."):
+    return processImages([file_path], output_dir, keep_crops=True)[0]
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(description="Crop the dosimeter out of still images and read its colour.")
+    parser.add_argument("images", nargs="+", help="image files, directories or glob patterns")
+    parser.add_argument("--output-dir", default=".",
+        help="directory the <image>_cropped.jpg crops and {} are written to (default: .)".format(SUMMARY_FILE))
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of processes (default: CPU count)")
+    return parser.parse_args(argv)
+
+# Usage: python3 Process_Frame.py <images, directories or globs> [--output-dir DIR] [--workers N]
 if __name__=="__main__":
-    main(sys.argv[1])
\ No newline at end of file
+    args = parseArguments(sys.argv[1:])
+    images = findImages(args.images)
+    if not images:
+        print("Error: No images found.")
+        sys.exit(1)
+
+    results = processImages(images, args.output_dir, args.workers)
+    found = sum(1 for result in results if result["status"] == "ok")
+    print("Dosimeter found in {} of {} images; summary written to {}.".format(found, len(results),
+        path.join(args.output_dir, SUMMARY_FILE)))
@@ -0,0 +1,40 @@
+# Benchmark of the dosimeter detection time per frame at 720p, 1080p and 4K, with and without
+# the downscaled (pyramid) detection.
+# Usage: python3 benchmarks/detection.py [frames per measurement]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import remask
+import synthetic
+
+RESOLUTIONS = [("720p", 1280, 720), ("1080p", 1920, 1080), ("4K", 3840, 2160)]
+
+# Returns the mean detection time in milliseconds, and the box found in the last frame.
+def timeDetection(analyzer, frame, scale, repeats):
+    box = analyzer.findDosimeter(frame, scale)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        box = analyzer.findDosimeter(frame, scale)
+    return (time.perf_counter() - start) * 1000 / repeats, box
+
+def main(repeats):
+    print("{:<8} {:>8} {:>14} {:>14} {:>8}".format("Size", "Scale", "Full (ms)", "Pyramid (ms)", "Speedup"))
+    for name, width, height in RESOLUTIONS:
+        frame, diameter = synthetic.renderFrame(width, height)
+
+        # Lock the expected size, as initDosSize does on the first frame.
+        analyzer = remask.Analyzer()
+        analyzer.DOS_MIN_SIZE = diameter - analyzer.TOLERANCE
+        analyzer.DOS_MAX_SIZE = diameter + analyzer.TOLERANCE
+        scale = max(analyzer.DOS_MIN_SIZE // analyzer.DETECT_MIN_PIXELS, 1)
+
+        full, full_box = timeDetection(analyzer, frame, 1, repeats)
+        pyramid, pyramid_box = timeDetection(analyzer, frame, scale, repeats)
+        if full_box != pyramid_box:
+            print("WARNING: {} boxes differ: {} and {}".format(name, full_box, pyramid_box))
+        print("{:<8} {:>8} {:>14.2f} {:>14.2f} {:>7.1f}x".format(name, scale, full, pyramid, full / pyramid))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
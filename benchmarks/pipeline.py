@@ -0,0 +1,150 @@
+# Benchmark of each stage of the program on synthetic videos (see synthetic.py): decoding, the
+# dosimeter detection of processFrames, the sampling of the cropped regions and the CSV output.
+# The frames per second of each stage and the peak memory are reported, and the sampled colours are
+# checked against the colours rendered into the video, so a faster stage cannot silently lose accuracy.
+# Usage: python3 benchmarks/pipeline.py [--resolutions 720p,1080p] [--fps 30] [--seconds 10] [--noise 3] [--jitter 2]
+#                                      [--decoders opencv,ffmpeg] [--mode all|filtered]
+# The exit status is 1 when the colours of any video are not within --tolerance of the rendered ones.
+import argparse
+import contextlib
+import io
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import remask
+import sinks
+import synthetic
+
+STAGES = ["decode", "detect", "sample", "csv"]
+
+# Returns the peak resident memory of the process so far, in megabytes.
+def peakMemory():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+# Locks the dosimeter size from the first frame of a video and places its sample points, as
+# analyzeVideo does. Returns the time spent placing the sample points and sampling the baseline, in seconds.
+def setUp(analyzer, filename):
+    analyzer.resetVideo(filename)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if analyzer.initDosSize(filename) == False:
+            raise RuntimeError("The dosimeter was not found in the first frame of {}".format(filename))
+        start = time.perf_counter()
+        analyzer.setOrigin(analyzer.ORIGIN_ROI)
+        return time.perf_counter() - start
+
+# Runs every stage over a video, decoding it with "decoder" (see remask.DECODE_BACKEND), and returns
+# the rows, in order, and the seconds spent in each stage.
+def timeStages(filename, output_dir, decoder="opencv", filter=False):
+    # Start analysing from the first frame, as the synthetic videos are short.
+    analyzer = remask.Analyzer(TIME_OFFSET=0, OUTPUT_DIR=output_dir, DECODE_BACKEND=decoder)
+    times = dict.fromkeys(STAGES, 0.0)
+    times["sample"] = setUp(analyzer, filename)
+
+    video = cv2.VideoCapture(filename)
+    rate, total, _ = analyzer.probeVideo(video, filename)
+    analyzer.setDecodeCrop(video)
+    frames = analyzer.decodeFrames(filename, video, analyzer.frameSchedule(rate, total, filter), rate)
+
+    rows = []
+    pending = []
+    while True:
+        start = time.perf_counter()
+        item = next(frames, None)
+        decoded = time.perf_counter()
+        times["decode"] += decoded - start
+        if item is None:
+            break
+
+        index, image = item
+        ROI = analyzer.processFrames(image, "frame {}".format(index))
+        pending.append(([index, *remask.frameLabel(index, rate)], None if ROI is None else ROI.copy()))
+        times["detect"] += time.perf_counter() - decoded
+
+        if len(pending) >= analyzer.SAMPLE_BATCH:
+            start = time.perf_counter()
+            rows.extend(analyzer.sampleRows(pending))
+            pending = []
+            times["sample"] += time.perf_counter() - start
+    video.release()
+
+    start = time.perf_counter()
+    rows.extend(analyzer.sampleRows(pending))
+    times["sample"] += time.perf_counter() - start
+
+    start = time.perf_counter()
+    sink = sinks.CsvSink(os.path.join(output_dir, analyzer.vid_name + ".csv"), analyzer.base_rgb, rate)
+    for row in rows:
+        sink.write(row)
+    sink.close()
+    times["csv"] += time.perf_counter() - start
+    return rows, times
+
+# Compares the sampled rows with the rendered testing colours.
+# Returns the number of frames in which the dosimeter was not found, and the mean and largest
+# difference of any channel over the other frames.
+def checkColours(rows, truth):
+    data = np.array(rows, dtype=np.int64).reshape(-1, 7)
+    found = data[:, 4] >= 0
+    errors = np.abs(data[found, 4:7] - truth[data[found, 0]])
+    if len(errors) == 0:
+        return len(data), 0.0, 0
+    return int((~found).sum()), float(errors.mean()), int(errors.max())
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(description="Times each stage of the dosimeter analysis on synthetic videos.")
+    parser.add_argument("--resolutions", default="720p,1080p",
+        help="comma separated list of {} (default: 720p,1080p)".format(", ".join(synthetic.RESOLUTIONS)))
+    parser.add_argument("--fps", type=float, default=30, help="frame rate of the videos (default: 30)")
+    parser.add_argument("--seconds", type=float, default=10, help="length of the videos in seconds (default: 10)")
+    parser.add_argument("--noise", type=float, default=3.0, help="standard deviation of the sensor noise (default: 3)")
+    parser.add_argument("--jitter", type=int, default=2, help="largest camera shake in pixels (default: 2)")
+    parser.add_argument("--tolerance", type=int, default=8,
+        help="largest accepted difference between a sampled and a rendered channel (default: 8)")
+    parser.add_argument("--decoders", default="opencv",
+        help="comma separated list of decoders to compare: opencv, ffmpeg (default: opencv)")
+    parser.add_argument("--mode", choices=["all", "filtered"], default="all",
+        help="analyse every frame, or only the frames of every 10th second (default: all)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the noise and the jitter (default: 0)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    arguments = parseArguments(argv)
+
+    print("{:<8} {:<8} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>7}  {}".format("Size", "Decoder", "Frames",
+        "Decode", "Detect", "Sample", "CSV", "Total", "Peak MB", "Mean err", "Misses", "Result"))
+    failed = False
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name in arguments.resolutions.split(","):
+            width, height = synthetic.RESOLUTIONS[name]
+            filename = os.path.join(output_dir, "synthetic_{}.mp4".format(name))
+            truth = synthetic.renderVideo(filename, width, height, arguments.fps, arguments.seconds,
+                arguments.noise, arguments.jitter, arguments.seed)
+
+            for decoder in arguments.decoders.split(","):
+                rows, times = timeStages(filename, output_dir, decoder, arguments.mode == "filtered")
+                misses, mean_error, max_error = checkColours(rows, truth)
+                passed = misses == 0 and max_error <= arguments.tolerance
+                failed = failed or not passed
+
+                # Frames per second of each stage, and of all of them together.
+                count = len(rows)
+                rates = [count / max(times[stage], 1e-9) for stage in STAGES] + [count / max(sum(times.values()), 1e-9)]
+                print("{:<8} {:<8} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.2f} {:>7}  {}".format(name,
+                    decoder, count, *rates, peakMemory(), mean_error, misses,
+                    "ok" if passed else "FAILED (largest error {})".format(max_error)))
+            os.remove(filename)
+
+    print("Stages are in frames per second.")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
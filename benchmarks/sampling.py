@@ -0,0 +1,72 @@
+# Check of remask.sampleBatch against a brute-force mean of every sample patch, on random zero-padded
+# batches (see remask.stackROIs) which include misses cached with a (0, 0) size, regions too small for the
+# sample points and batches holding nothing but misses, as roicache.loadEntry returns them.
+# Usage: python3 benchmarks/sampling.py [batches per patch size] [--seed N]
+# The exit status is 1 when any batch differs from the brute-force means.
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import remask
+
+PATCHES = [1, 2, 3, 5, 8]
+
+# Returns the (r, g, b) sampleBatch should return for one region of a batch: the rounded mean of the
+# patch x patch squares around the sample points, clipped to the real "size" of the region, or -1 when a
+# sample point falls outside of it.
+def bruteForce(region, size, values, patch):
+    height, width = size
+    half = patch // 2
+    means = []
+    for x, y in values:
+        if not (0 <= y < height and 0 <= x < width):
+            return [-1, -1, -1]
+        if patch <= 1:
+            means.append(region[y, x].astype(float))
+        else:
+            square = region[max(y - half, 0) : min(y + patch - half, height), max(x - half, 0) : min(x + patch - half, width)]
+            means.append(square.reshape(-1, 3).sum(axis=0) / (square.shape[0] * square.shape[1]))
+    return [int(v) for v in np.round((np.sum(means, axis=0) / len(values))[::-1])]
+
+# Returns a random padded batch, the (height, width) of each region and the sample points.
+def randomBatch(rng, misses_only):
+    count = int(rng.integers(1, 12))
+    sizes = rng.integers(8, 48, (count, 2))
+    if misses_only:
+        sizes[:] = 0
+    else:
+        sizes[rng.random(count) < 0.3] = 0
+    height, width = sizes.max(axis=0) if sizes.max() > 0 else (int(rng.integers(0, 48)), int(rng.integers(0, 48)))
+    batch = np.zeros((count, height, width, 3), dtype=np.uint8)
+    for i, (h, w) in enumerate(sizes):
+        batch[i, :h, :w] = rng.integers(0, 256, (h, w, 3))
+    values = [(int(x), int(y)) for x, y in rng.integers(0, 40, (int(rng.integers(1, 6)), 2))]
+    return batch, sizes, values
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compares sampleBatch with a brute-force mean on random padded batches.")
+    parser.add_argument("batches", type=int, nargs="?", default=200, help="batches per patch size (default: 200)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the batches (default: 0)")
+    arguments = parser.parse_args(argv)
+
+    rng = np.random.default_rng(arguments.seed)
+    failed = 0
+    for patch in PATCHES:
+        for i in range(arguments.batches):
+            batch, sizes, values = randomBatch(rng, misses_only=i % 10 == 0)
+            found = remask.sampleBatch(batch, values, patch, sizes).tolist()
+            expected = [bruteForce(batch[j], sizes[j], values, patch) for j in range(len(batch))]
+            if found != expected:
+                failed += 1
+                if failed <= 5:
+                    print("Patch {}: sizes {}, points {}: {} instead of {}".format(patch, sizes.tolist(), values, found, expected))
+        print("Patch {}: {} batches checked.".format(patch, arguments.batches))
+
+    print("ok" if failed == 0 else "FAILED ({} batches differ)".format(failed))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
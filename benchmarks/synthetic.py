@@ -0,0 +1,71 @@
+# Renders synthetic dosimeter videos with a known colour, so the speed and the accuracy of the
+# program can be measured without a real recording.
+# The dosimeter is an outer ring around an inner circle, sized with remask.inner_ratio and
+# remask.outer_ratio, on a dark background. The inner (testing) colour drifts slowly over the video,
+# the outer (baseline) colour stays the same, and sensor noise and camera jitter are added.
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import remask
+
+BACKGROUND = 30
+
+# Colours are (r, g, b); both stay within the colour limits of remask.Analyzer.isDosimeter.
+BASELINE_RGB = (190, 170, 60)
+TESTING_START_RGB = (185, 160, 75)
+TESTING_END_RGB = (150, 110, 150)
+
+RESOLUTIONS = {"480p": (640, 480), "720p": (1280, 720), "1080p": (1920, 1080), "4K": (3840, 2160)}
+
+# Returns the (r, g, b) testing colour at "progress" (0 to 1) through the video.
+def testingColour(progress):
+    start = np.array(TESTING_START_RGB, dtype=float)
+    end = np.array(TESTING_END_RGB, dtype=float)
+    return tuple(int(round(v)) for v in start + (end - start) * progress)
+
+# Renders one frame; the dosimeter diameter is a third of the frame height.
+# Returns the BGR frame and the dosimeter diameter in pixels.
+def renderFrame(width, height, testing_rgb=TESTING_START_RGB, noise=3.0, offset=(0, 0), rng=None):
+    if rng is None:
+        rng = np.random.default_rng(0)
+    frame = np.full((height, width, 3), BACKGROUND, dtype=np.uint8)
+
+    radius = height // 6
+    center = (width // 2 + offset[0], height // 2 + offset[1])
+    inner_radius = int(round(radius * remask.inner_ratio / (remask.inner_ratio + remask.outer_ratio)))
+    cv2.circle(frame, center, radius, BASELINE_RGB[::-1], -1)
+    cv2.circle(frame, center, inner_radius, testing_rgb[::-1], -1)
+
+    if noise > 0:
+        frame = np.clip(frame + rng.normal(0, noise, frame.shape), 0, 255).astype(np.uint8)
+    return frame, 2 * radius + 1
+
+# Writes a synthetic video; "jitter" is the largest camera shake in pixels.
+# Returns the (r, g, b) testing colour rendered in every frame, as an (N, 3) array.
+def renderVideo(filename, width, height, fps=30, seconds=10, noise=3.0, jitter=2, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = int(fps * seconds)
+    writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError("Unable to write video {}".format(filename))
+
+    truth = np.zeros((frames, 3), dtype=np.int64)
+    for i in range(frames):
+        truth[i] = testingColour(i / max(frames - 1, 1))
+        offset = tuple(int(v) for v in rng.integers(-jitter, jitter + 1, 2)) if jitter > 0 else (0, 0)
+        frame, _ = renderFrame(width, height, tuple(int(v) for v in truth[i]), noise, offset, rng)
+        writer.write(frame)
+
+    writer.release()
+    return truth
+
+if __name__ == "__main__":
+    # Usage: python3 benchmarks/synthetic.py <output.mp4> [resolution] [fps] [seconds]
+    name = sys.argv[2] if len(sys.argv) > 2 else "720p"
+    fps = float(sys.argv[3]) if len(sys.argv) > 3 else 30
+    seconds = float(sys.argv[4]) if len(sys.argv) > 4 else 10
+    renderVideo(sys.argv[1], *RESOLUTIONS[name], fps=fps, seconds=seconds)
@@ -0,0 +1,165 @@
+import json
+import os
+
+import cv2
+import numpy as np
+
+import detector
+
+# Automatic calibration of the colour limits (R_LOWER to B_UPPER) and of the expected dosimeter size.
+# The contours of a few frames spread over a video are found once, and for each contour candidate its
+# bounding box and the colours at its sample points are kept. A grid of colour limits, around the colours
+# seen in the candidates, and of size limits, around their sizes, is then scored against every candidate
+# at once. The limits chosen find a dosimeter in the most frames, with the most consistent size, and are
+# the widest of those, so they hold up to the colour changing during exposure.
+# The chosen limits can be saved to a file and loaded for later videos from the same rig:
+#   {"video": ..., "frames": ..., "sampled": ..., "parameters": {"R_LOWER": ..., "DEFAULT_SIZE": [min, max]}}
+
+# Margins added on either side of a candidate colour, and tolerances (fractions of a candidate size) tried.
+COLOUR_MARGINS = [15, 25, 40, 60]
+SIZE_TOLERANCES = [0.1, 0.2, 0.35]
+
+# Colours and sizes are rounded to multiples of GRID_STEP, and the GRID_CENTRES most common of each are tried.
+# Contours less than MIN_SIDE pixels across are left out.
+GRID_STEP = 5
+GRID_CENTRES = 32
+MIN_SIDE = 20
+
+# The chosen colour limits are widened to at least COLOUR_SLACK beyond the colours of the dosimeter's samples
+# which pass them in the sampled frames, for the frames in between, whose colours may lie a little outside.
+COLOUR_SLACK = 15
+
+# Two sets of limits whose size spreads are within SPREAD_SLACK of each other count as equally consistent.
+SPREAD_SLACK = 0.05
+
+# Returns the candidates of a frame: the (N, 4) (x, y, w, h) boxes of its contours which are at least
+# MIN_SIDE pixels across, their (N,) contour areas, whether their samples fall inside of them, and their
+# (N, samples, 3) colours. The contours are searched as in detector.findCandidates.
+# Contours touching the edges of the frame (e.g. around a uniform frame) are left out.
+def frameCandidates(image, x_off, y_off, samples):
+    contours, boxes = detector.contourBoxes(detector.thresholdImage(image), cv2.RETR_LIST)
+    x, y, w, h = boxes.T
+    inner = (x > 0) & (y > 0) & (x + w < image.shape[1]) & (y + h < image.shape[0])
+    keep = np.flatnonzero(inner & (w >= MIN_SIDE) & (h >= MIN_SIDE))
+    areas = np.array([cv2.contourArea(contours[i]) for i in keep], dtype=np.float64)
+    inside, rgb = detector.probeColours(image, boxes[keep], x_off, y_off, samples)
+    return boxes[keep], areas, inside, rgb
+
+# Returns up to "count" of the most common rows of "values", rounded to multiples of GRID_STEP.
+def commonValues(values, count):
+    rounded = np.round(np.asarray(values, dtype=float) / GRID_STEP).astype(np.int64) * GRID_STEP
+    if len(rounded) == 0:
+        return rounded
+    unique, counts = np.unique(rounded, axis=0, return_counts=True)
+    return unique[np.argsort(-counts, kind="stable")[:count]]
+
+# Returns the grid of limits to score, from the candidates of the sampled frames:
+# the (G, 3) lower and upper colour limits with their margins, and the (K,) size limits with their tolerances.
+def parameterGrid(boxes, inside, rgb):
+    colours = commonValues(np.median(rgb[inside], axis=1), GRID_CENTRES)
+    sides = commonValues(boxes[inside][:, 2:].max(axis=1, initial=0)[:, None], GRID_CENTRES)[:, 0]
+
+    margins = np.repeat(COLOUR_MARGINS, len(colours))
+    lower = np.clip(np.tile(colours, (len(COLOUR_MARGINS), 1)) - margins[:, None], -1, 255)
+    upper = np.clip(np.tile(colours, (len(COLOUR_MARGINS), 1)) + margins[:, None], 0, 256)
+
+    tolerances = np.repeat(SIZE_TOLERANCES, len(sides))
+    min_sizes = np.floor(np.tile(sides, len(SIZE_TOLERANCES)) * (1 - tolerances))
+    max_sizes = np.ceil(np.tile(sides, len(SIZE_TOLERANCES)) * (1 + tolerances))
+    return lower, upper, margins, min_sizes, max_sizes, tolerances
+
+# Scores every combination of colour limits (G) and size limits (K) against all of the candidates, whose
+# frame is given by "frames" (F frames, in order). Returns (G, K) arrays of the number of frames in which
+# the limits find a dosimeter, and of the spread of the size found ((largest - smallest) / mean side, the
+# side being the square root of the contour area).
+def scoreGrid(boxes, areas, inside, rgb, frames, lower, upper, min_sizes, max_sizes, samples):
+    valid = ((lower[:, None, None] < rgb) & (rgb < upper[:, None, None])).all(axis=3)
+    colour = inside & (valid.sum(axis=2) > samples // 2)
+    w, h = boxes[:, 2], boxes[:, 3]
+    size = ((min_sizes[:, None] <= w) & (w <= max_sizes[:, None]) & (min_sizes[:, None] <= h) & (h <= max_sizes[:, None]))
+
+    # Candidates which no limits pass cannot change the scores.
+    keep = colour.any(axis=0) & size.any(axis=0)
+    if not keep.any():
+        return np.zeros((len(lower), len(min_sizes)), dtype=np.int64), np.full((len(lower), len(min_sizes)), np.inf)
+    colour, size, frames, areas = colour[:, keep], size[:, keep], frames[keep], areas[keep]
+    passed = colour[:, None] & size[None]
+
+    # The dosimeter is the candidate with the largest contour area which passes, as in detector.findCandidates.
+    starts = np.flatnonzero(np.r_[True, frames[1:] != frames[:-1]])
+    found = np.logical_or.reduceat(passed, starts, axis=2)
+    largest = np.maximum.reduceat(np.where(passed, areas, 0), starts, axis=2)
+    hits = found.sum(axis=2)
+
+    side = np.sqrt(largest)
+    biggest = np.where(found, side, 0).max(axis=2)
+    smallest = np.where(found, side, np.inf).min(axis=2)
+    mean = side.sum(axis=2) / np.maximum(hits, 1)
+    spread = np.where(hits > 0, (biggest - smallest) / np.maximum(mean, 1), np.inf)
+    return hits, spread
+
+# Returns the indices of the candidates found as the dosimeter with one set of limits: the candidate with the
+# largest contour area which passes them in each frame.
+def foundCandidates(boxes, areas, inside, rgb, frames, lower, upper, min_size, max_size, samples):
+    valid = ((lower < rgb) & (rgb < upper)).all(axis=2)
+    w, h = boxes[:, 2], boxes[:, 3]
+    passed = inside & (valid.sum(axis=1) > samples // 2) & (min_size <= w) & (w <= max_size) & (min_size <= h) & (h <= max_size)
+    found = []
+    for frame in np.unique(frames[passed]):
+        indices = np.flatnonzero(passed & (frames == frame))
+        found.append(indices[np.argmax(areas[indices])])
+    return np.array(found, dtype=np.intp)
+
+# Chooses the limits for the candidates of each sampled frame (see frameCandidates).
+# Returns the parameters, named as the settings of remask.py, the number of frames the dosimeter is found in
+# with them and the number of frames sampled; the parameters are None when no limits find it in any frame.
+def chooseParameters(candidates, samples):
+    if not candidates:
+        return None, 0, 0
+    frames = np.concatenate([np.full(len(boxes), i) for i, (boxes, _, _, _) in enumerate(candidates)])
+    boxes = np.concatenate([boxes for boxes, _, _, _ in candidates])
+    areas = np.concatenate([areas for _, areas, _, _ in candidates])
+    inside = np.concatenate([inside for _, _, inside, _ in candidates])
+    rgb = np.concatenate([rgb for _, _, _, rgb in candidates])
+    if not inside.any():
+        return None, 0, len(candidates)
+
+    lower, upper, margins, min_sizes, max_sizes, tolerances = parameterGrid(boxes, inside, rgb)
+    hits, spread = scoreGrid(boxes, areas, inside, rgb, frames, lower, upper, min_sizes, max_sizes, samples)
+    if hits.max() == 0:
+        return None, 0, len(candidates)
+
+    # Most frames found first, then the most consistent size, then the widest limits.
+    best = hits == hits.max()
+    best &= spread <= spread[best].min() + SPREAD_SLACK
+    width = margins[:, None] * 100 + tolerances[None, :]
+    g, k = np.unravel_index(np.argmax(np.where(best, width, -np.inf)), best.shape)
+
+    found = foundCandidates(boxes, areas, inside, rgb, frames, lower[g], upper[g], min_sizes[k], max_sizes[k], samples)
+    # Only the samples within the limits are widened from, so a dark print or label on the dosimeter
+    # cannot push the limits out until they pass any colour.
+    colours = rgb[found]
+    colours = colours[((lower[g] < colours) & (colours < upper[g])).all(axis=2)]
+    lower = np.clip(np.minimum(lower[g], colours.min(axis=0) - COLOUR_SLACK), -1, 255)
+    upper = np.clip(np.maximum(upper[g], colours.max(axis=0) + COLOUR_SLACK), 0, 256)
+
+    parameters = {}
+    for i, channel in enumerate("RGB"):
+        parameters[channel + "_LOWER"] = int(lower[i])
+        parameters[channel + "_UPPER"] = int(upper[i])
+    parameters["DEFAULT_SIZE"] = [int(min_sizes[k]), int(max_sizes[k])]
+    return parameters, int(hits[g, k]), len(candidates)
+
+def saveParameters(filename, parameters, video, frames, sampled):
+    temporary = filename + ".tmp"
+    with open(temporary, "w") as parameters_file:
+        json.dump({"video": video, "frames": frames, "sampled": sampled, "parameters": parameters}, parameters_file, indent=2)
+    os.replace(temporary, filename)
+
+# Returns the parameters saved by saveParameters.
+def loadParameters(filename):
+    with open(filename) as parameters_file:
+        parameters = json.load(parameters_file)["parameters"]
+    if "DEFAULT_SIZE" in parameters:
+        parameters["DEFAULT_SIZE"] = tuple(parameters["DEFAULT_SIZE"])
+    return parameters
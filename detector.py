@@ -0,0 +1,93 @@
+import cv2 # Computer vision library
+import numpy as np
+
+# Dosimeter detector shared by remask.py and Process_Frame.py. Each script passes its own size and
+# colour limits, built with makeLimits:
+#   min_size, max_size: the dosimeter must be between min_size and max_size pixels, squared.
+#   lower, upper: (r, g, b) bounds; a sample is valid when lower < value < upper for every channel.
+#   x_off, y_off: offsets of the four quadrant samples from the center of a region.
+#   samples: number of samples taken (at most 5: the center and the four quadrants).
+def makeLimits(min_size, max_size, lower, upper, x_off=10, y_off=10, samples=5):
+    return {"min_size": min_size, "max_size": max_size, "lower": tuple(lower), "upper": tuple(upper),
+        "x_off": x_off, "y_off": y_off, "samples": samples}
+
+# Returns the limits for a region downscaled by "scale": the sizes are scaled and widened by a
+# pixel of rounding, and the offsets are scaled with the region.
+def scaleLimits(limits, scale):
+    if scale <= 1:
+        return limits
+    scaled = dict(limits)
+    scaled["min_size"] = limits["min_size"] / scale - 1
+    scaled["max_size"] = limits["max_size"] / scale + 1
+    scaled["x_off"] = max(int(limits["x_off"] // scale), 1)
+    scaled["y_off"] = max(int(limits["y_off"] // scale), 1)
+    return scaled
+
+# Returns a boolean array telling which of the (x, y, w, h) boxes are approximately the size of the dosimeter.
+def sizeTest(boxes, limits):
+    boxes = np.asarray(boxes).reshape(-1, 4)
+    width = boxes[:, 2]
+    height = boxes[:, 3]
+    return ((limits["min_size"] <= width) & (width <= limits["max_size"])
+        & (limits["min_size"] <= height) & (height <= limits["max_size"]))
+
+# Returns a boolean array telling which of the (x, y, w, h) boxes of an image enclose the dosimeter.
+# Treating the center of each box as the origin, the X and Y offsets are used to probe the RGB values
+# of the center and the four quadrants; over half of the samples must be within the colour limits.
+# All of the boxes are tested at once. Samples falling outside of their box reject it.
+def colourTest(image, boxes, limits):
+    samples = limits["samples"]
+    inside, rgb = probeColours(image, boxes, limits["x_off"], limits["y_off"], samples)
+    valid = ((np.array(limits["lower"]) < rgb) & (rgb < np.array(limits["upper"]))).all(axis=2)
+    return inside & (valid.sum(axis=1) > samples // 2)
+
+# Returns, for each of the (x, y, w, h) boxes of an image, whether all of its samples fall inside of it,
+# and the (r, g, b) values of its samples, as an (N, samples, 3) array.
+def probeColours(image, boxes, x_off, y_off, samples):
+    boxes = np.asarray(boxes, dtype=np.intp).reshape(-1, 4)
+    x, y, w, h = boxes.T
+
+    # Sample coordinates relative to each box, one column per sample.
+    rows = (h // 2)[:, None] + np.array([0, x_off, x_off, -x_off, -x_off])[:samples]
+    cols = (w // 2)[:, None] + np.array([0, y_off, -y_off, y_off, -y_off])[:samples]
+    inside = ((rows >= 0) & (rows < h[:, None]) & (cols >= 0) & (cols < w[:, None])).all(axis=1)
+
+    rows = np.clip(rows + y[:, None], 0, image.shape[0] - 1)
+    cols = np.clip(cols + x[:, None], 0, image.shape[1] - 1)
+    bgr = image[rows, cols].astype(np.int16)
+    return inside, bgr[..., ::-1]
+
+# Returns the OTSU thresholded grayscale of a BGR image, in which the contours are searched.
+def thresholdImage(image):
+    image_gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    _, threshold = cv2.threshold(image_gray, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+    return threshold
+
+# Returns the contours of a thresholded image, found with "mode" (e.g. cv2.RETR_LIST), and their
+# (x, y, w, h) bounding boxes as an (N, 4) array.
+def contourBoxes(threshold, mode):
+    contours,_ = cv2.findContours(threshold, mode, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = np.array([cv2.boundingRect(c) for c in contours], dtype=np.intp).reshape(-1, 4)
+    return contours, boxes
+
+# Returns the (x, y, w, h) bounding boxes of the regions of an image which pass the size and colour
+# checks, from the largest contour area to the smallest.
+# Every contour is searched, nested ones included, as a dosimeter may lie inside another contour (e.g. a
+# well in a tray). Contours are first discarded by the size of their bounding box, before any area is
+# computed or region sliced, and the colour check runs once over all the remaining candidates.
+# "scale" is the factor the image has been downscaled by.
+def findCandidates(image, limits, scale=1):
+    limits = scaleLimits(limits, scale)
+
+    # Convert the original image into grayscale, and apply OTSU filtering to it.
+    threshold = thresholdImage(image)
+    contours, boxes = contourBoxes(threshold, cv2.RETR_LIST)
+
+    keep = np.flatnonzero(sizeTest(boxes, limits))
+    if len(keep) > 0:
+        keep = keep[colourTest(image, boxes[keep], limits)]
+
+    # Sort the remaining contours based on area, in descending order.
+    areas = [cv2.contourArea(contours[i]) for i in keep]
+    order = sorted(range(len(keep)), key=lambda i: areas[i], reverse=True)
+    return [tuple(int(v) for v in boxes[keep[i]]) for i in order]
@@ -0,0 +1,199 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+# Opt-in instrumentation of an analysis run: counters (e.g. frames decoded, detections, misses) and
+# histograms of stage latencies and of the dosimeter candidates found per frame.
+# The analysis always calls the same methods; when instrumentation is off it calls them on NullMetrics,
+# whose methods do nothing and whose clock() does not read the time, so the cost is a method call.
+# Timed sections are written as:
+#   start = METRICS.clock()
+#   ...
+#   METRICS.timed("detect_seconds", start)
+
+# Upper bounds of the latency buckets, in seconds.
+SECONDS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# Upper bounds of the buckets of values which are counts.
+COUNTS = [0, 1, 2, 3, 5, 10, 20, 50, 100]
+
+# Histograms which may be recorded: their bucket bounds and description.
+HISTOGRAMS = {
+    "decode_seconds": (SECONDS, "Time to seek or grab to a scheduled frame and decode it."),
+    "detect_seconds": (SECONDS, "Time to find and crop the dosimeter in a frame."),
+    "sample_seconds": (SECONDS, "Time to sample a batch of cropped regions."),
+    "write_seconds": (SECONDS, "Time to hand a row to the result sinks."),
+    "debug_write_seconds": (SECONDS, "Time to write a debug image to disk."),
+    "latency_seconds": (SECONDS, "Time from capturing a live frame to writing its reading."),
+    "candidates": (COUNTS, "Dosimeter candidates passing the size and colour checks per search."),
+}
+
+# Descriptions of the counters.
+COUNTERS = {
+    "frames_decoded": "Frames decoded from the video.",
+    "seeks": "Seeks made to reach a scheduled frame.",
+    "frames_grabbed": "Frames skipped with grab() without being decoded.",
+    "detections": "Frames in which the dosimeter was found.",
+    "misses": "Frames in which the dosimeter was not found.",
+    "tracking_fallbacks": "Frames in which tracking fell back to a full-frame search.",
+    "frames_sampled": "Cropped regions sampled.",
+    "rows_written": "Rows written to the result sinks.",
+    "frames_dropped": "Live frames replaced by a newer frame before being analysed.",
+    "late_readings": "Live readings written later than the latency budget.",
+}
+
+class NullMetrics:
+    def clock(self):
+        return 0
+
+    def timed(self, name, start):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+    def progress(self, done):
+        pass
+
+class Metrics(NullMetrics):
+    # "expected" is the number of frames the run is expected to analyse (0 when unknown), and progress
+    # is printed at most every "interval" seconds.
+    def __init__(self, expected=0, interval=10.0):
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.histograms = {name: {"buckets": [0] * (len(bounds) + 1), "sum": 0.0, "count": 0}
+            for name, (bounds, _) in HISTOGRAMS.items()}
+        self.expected = expected
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last_report = self.start
+        self.done = 0
+
+    def clock(self):
+        return time.perf_counter()
+
+    def timed(self, name, start):
+        self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, value):
+        bucket = bisect.bisect_left(HISTOGRAMS[name][0], value)
+        with self.lock:
+            histogram = self.histograms[name]
+            histogram["buckets"][bucket] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    # Adds the counters and histograms recorded in another process (see snapshot).
+    def merge(self, snapshot):
+        with self.lock:
+            for name, value in snapshot["counters"].items():
+                self.counters[name] += value
+            for name, other in snapshot["histograms"].items():
+                histogram = self.histograms[name]
+                histogram["buckets"] = [a + b for a, b in zip(histogram["buckets"], other["buckets"])]
+                histogram["sum"] += other["sum"]
+                histogram["count"] += other["count"]
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps({"counters": self.counters, "histograms": self.histograms}))
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    # Records that "done" frames have been analysed, and prints the throughput and the time left.
+    def progress(self, done):
+        self.done = done
+        now = time.perf_counter()
+        if now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        rate = done / max(now - self.start, 1e-9)
+        if self.expected > 0 and rate > 0:
+            remaining = max(self.expected - done, 0) / rate
+            print("{} of {} frames, {:.1f} frames/s, {:.0f}s left.".format(done, self.expected, rate, remaining))
+        else:
+            print("{} frames, {:.1f} frames/s.".format(done, rate))
+
+    # Returns the report written by writeReport: the counters, the throughput and, for each histogram,
+    # its buckets and approximate quantiles (the upper bound of the bucket holding the quantile).
+    def report(self, labels=None):
+        snapshot = self.snapshot()
+        elapsed = self.elapsed()
+        histograms = {}
+        for name, histogram in snapshot["histograms"].items():
+            bounds = HISTOGRAMS[name][0]
+            summary = dict(histogram, bounds=bounds, mean=histogram["sum"] / max(histogram["count"], 1))
+            for quantile in (0.5, 0.95, 0.99):
+                summary["p{:g}".format(quantile * 100)] = quantileBound(histogram["buckets"], bounds, quantile)
+            histograms[name] = summary
+        return {
+            "labels": dict(labels or {}),
+            "seconds": elapsed,
+            "frames": self.done,
+            "expected_frames": self.expected,
+            "frames_per_second": self.done / max(elapsed, 1e-9),
+            "counters": snapshot["counters"],
+            "histograms": histograms,
+        }
+
+    # Writes the report to <prefix>_metrics.json and, in the Prometheus text format (for the node
+    # exporter's textfile collector), to <prefix>.prom.
+    def writeReport(self, prefix, labels=None):
+        report = self.report(labels)
+        writeAtomic(prefix + "_metrics.json", json.dumps(report, indent=2))
+        writeAtomic(prefix + ".prom", prometheusText(report))
+
+# Returns the upper bound of the bucket holding the "quantile" of the observations, None when there are none.
+def quantileBound(buckets, bounds, quantile):
+    total = sum(buckets)
+    if total == 0:
+        return None
+    seen = 0
+    for i, count in enumerate(buckets):
+        seen += count
+        if seen >= quantile * total:
+            return bounds[i] if i < len(bounds) else float("inf")
+
+def prometheusText(report):
+    labels = ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in sorted(report["labels"].items()))
+
+    def series(name, extra=""):
+        inner = ",".join(part for part in (labels, extra) if part)
+        return "remask_{}{{{}}}".format(name, inner) if inner else "remask_" + name
+
+    lines = []
+    for name, value in report["counters"].items():
+        lines += ["# HELP remask_{}_total {}".format(name, COUNTERS[name]), "# TYPE remask_{}_total counter".format(name)]
+        lines.append("{} {}".format(series(name + "_total"), value))
+
+    for name, help_text, value in [("run_seconds", "Duration of the run.", report["seconds"]),
+            ("frames_per_second", "Frames analysed per second over the run.", report["frames_per_second"])]:
+        lines += ["# HELP remask_{} {}".format(name, help_text), "# TYPE remask_{} gauge".format(name)]
+        lines.append("{} {}".format(series(name), value))
+
+    for name, histogram in report["histograms"].items():
+        lines += ["# HELP remask_{} {}".format(name, HISTOGRAMS[name][1]), "# TYPE remask_{} histogram".format(name)]
+        cumulative = 0
+        for bound, count in zip(histogram["bounds"] + ["+Inf"], histogram["buckets"]):
+            cumulative += count
+            lines.append("{} {}".format(series(name + "_bucket", 'le="{}"'.format(bound)), cumulative))
+        lines.append("{} {}".format(series(name + "_sum"), histogram["sum"]))
+        lines.append("{} {}".format(series(name + "_count"), histogram["count"]))
+    return "\n".join(lines) + "\n"
+
+def writeAtomic(filename, text):
+    temporary = filename + ".tmp"
+    with open(temporary, "w") as report_file:
+        report_file.write(text)
+    os.replace(temporary, filename)
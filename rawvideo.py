@@ -0,0 +1,86 @@
+import shutil
+import subprocess
+import tempfile
+
+import numpy as np
+
+# Decoding backend which pipes raw BGR frames out of an ffmpeg process, as an alternative to
+# cv2.VideoCapture. Seeking to the first frame, the number of frames read and the crop around the
+# dosimeter all happen inside ffmpeg's (multithreaded) decoder and filter graph, so Python only
+# receives the frames it asked for, already cropped. Frames are NumPy views over a small ring of
+# reusable buffers, which ffmpeg's output is read straight into. ffmpeg's errors go to a temporary file
+# rather than a pipe, which a damaged video could fill while the frames are being read, blocking ffmpeg.
+
+# Bytes of ffmpeg's error output reported when it fails.
+ERROR_BYTES = 4096
+
+def available():
+    return shutil.which("ffmpeg") is not None
+
+# Reads the frames of a video from ffmpeg, starting at the frame index "start".
+#   size:    (width, height) of the decoded frames, before cropping.
+#   rate:    frame rate of the video, used to seek to "start".
+#   crop:    optional (x, y, w, h) region the frames are cropped to.
+#   count:   stop after this many frames (0 reads until the end of the video).
+#   buffers: number of buffers the frames are read into, in turn. A frame stays valid until "buffers"
+#            more frames have been read, so a consumer holding on to frames needs more than one.
+class RawVideoReader:
+    def __init__(self, filename, size, rate, start=0, crop=None, count=0, buffers=1):
+        width, height = size
+        if crop is not None:
+            _, _, width, height = crop
+        self.shape = (height, width, 3)
+        self.frame_bytes = width * height * 3
+        self.buffers = [bytearray(self.frame_bytes) for _ in range(max(buffers, 1))]
+        self.next_buffer = 0
+
+        command = ["ffmpeg", "-v", "error", "-nostdin"]
+        if start > 0:
+            # Seek half a frame early, so rounding of the timestamps cannot skip the first frame; ffmpeg
+            # decodes from the previous keyframe and drops the frames before this position.
+            command += ["-ss", repr((start - 0.5) / rate)]
+        command += ["-i", filename, "-an", "-sn", "-dn"]
+
+        if crop is not None:
+            command += ["-vf", "crop={2}:{3}:{0}:{1}:exact=1".format(*crop)]
+        if count > 0:
+            command += ["-frames:v", str(count)]
+        # Pass the decoded frames through as they are, without duplicating or dropping any.
+        command += ["-vsync", "0", "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1"]
+
+        self.errors = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=self.errors, bufsize=0)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        buffer = self.buffers[self.next_buffer]
+        view = memoryview(buffer)
+        filled = 0
+        while filled < self.frame_bytes:
+            read = self.process.stdout.readinto(view[filled:])
+            if not read:
+                self.process.wait()
+                self.close()
+                raise StopIteration
+            filled += read
+
+        self.next_buffer = (self.next_buffer + 1) % len(self.buffers)
+        return np.frombuffer(buffer, dtype=np.uint8).reshape(self.shape)
+
+    # Stops ffmpeg when it is still running; raises an error, with the last ERROR_BYTES of its errors,
+    # when it failed on its own.
+    def close(self):
+        if self.process.stdout.closed:
+            return
+        stopped = self.process.poll() is None
+        if stopped:
+            self.process.kill()
+        self.process.wait()
+        self.process.stdout.close()
+        self.errors.seek(max(self.errors.seek(0, 2) - ERROR_BYTES, 0))
+        error = self.errors.read().decode(errors="replace").strip()
+        self.errors.close()
+        if not stopped and self.process.returncode != 0:
+            raise RuntimeError("ffmpeg failed: {}".format(error))
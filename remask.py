@@ -1,30 +1,101 @@
-from PIL import Image # Opening and saving images
-import csv # Writing to CSV file
+import argparse
+import concurrent.futures
+import copy
+import calibration # Automatic colour and size thresholds
 import cv2 # Computer vision library
-import moviepy.editor # Video functions (length, etc.)
+import detector # Dosimeter detection shared with Process_Frame.py
+import glob
+import hashlib
+import json
+import metrics # Opt-in instrumentation
 import os # (Deleting files)
 from os import path # (Filepath helper)
 import numpy as np
+import roicache # Cache of the cropped dosimeter regions
+import sinks # Result output formats
 import sys
 import math
-
-# Global variable to define the fps of the video file to be used
+import multiprocessing
+import queue
+import rawvideo # ffmpeg decoding backend
+import shutil
+import subprocess
+import threading
+import time
+
+# Settings. Each Analyzer copies them when it is created, so they are the defaults of every analysis;
+# an Analyzer can also be given its own values (see Analyzer).
+
+# Fallback fps, used only when the video container does not report its own frame rate.
 fps = 30
 
+# Gaps between scheduled frames larger than this many frames are reached with a seek
+# (CAP_PROP_POS_FRAMES) instead of grabbing the frames in between.
+SEEK_THRESHOLD = 60
+
+# Number of processes used to analyse a single video. With 1, the video is analysed serially.
+WORKERS = 1
+
+# Decoder of the scheduled frames: "opencv" (cv2.VideoCapture) or "ffmpeg", which pipes raw frames out
+# of a local ffmpeg process (see rawvideo.py). With ffmpeg, the offset, the frame selection and the crop
+# happen in ffmpeg: frames are cropped to the dosimeter found in the origin frame, widened by
+# FFMPEG_CROP_MARGIN pixels on each side, so the dosimeter should not move by more than that.
+DECODE_BACKEND = "opencv"
+FFMPEG_CROP_MARGIN = 100
+
+# Number of detection/sampling threads used by the threaded pipeline, which overlaps decoding,
+# detection and writing (0 disables the pipeline). PIPELINE_QUEUE bounds the frames in flight
+# between the stages.
+PIPELINE_THREADS = 0
+PIPELINE_QUEUE = 32
+
+# Formats the results are written in (see sinks.FORMATS): "csv" writes <vid_name>.csv,
+# "columns" writes typed, memory-mappable columns into <vid_name>_columns and "stats" writes the mean,
+# standard deviation, minimum, maximum and misses of every AGGREGATE_SECONDS seconds to <vid_name>_stats.csv.
+# Selecting "stats" alone keeps only the statistics, instead of a row for every frame.
+RESULT_FORMATS = ["csv"]
+AGGREGATE_SECONDS = 1.0
+
+# A checkpoint (<vid_name>.checkpoint.json) is written every CHECKPOINT_FRAMES written rows, so an
+# interrupted run can be resumed (0 disables checkpoints).
+CHECKPOINT_FRAMES = 1000
+
+# The cropped regions of a video can be cached in ROI_CACHE_DIR ("" disables the cache), so a later
+# run with other sample points only repeats the sampling. Old entries are removed to keep the cache
+# within ROI_CACHE_BUDGET bytes.
+ROI_CACHE_DIR = ""
+ROI_CACHE_BUDGET = 10 * 1024 * 1024 * 1024
+
+# Set INSTRUMENT to record counters and stage latencies while analysing a video (see metrics.py), and to
+# print the throughput and the time left every METRICS_INTERVAL seconds. The report is written next to
+# the results as <vid_name>_metrics.json and, in the Prometheus text format, <vid_name>.prom.
+INSTRUMENT = False
+METRICS_INTERVAL = 10.0
+
+# Live mode: the newest frame of a live source is analysed LIVE_RATE times per second, and each reading
+# should be written within LIVE_LATENCY seconds of its frame being captured.
+LIVE_RATE = 1.0
+LIVE_LATENCY = 0.5
+
+# Batch mode: file extensions picked up from directories, and the estimated base memory of a
+# worker process in bytes, used to keep concurrent videos within the memory budget.
+VIDEO_EXTENSIONS = [".mp4", ".mov", ".avi", ".mkv", ".m4v"]
+PROCESS_MEMORY = 150 * 1024 * 1024
+
 # Defines the number of seconds until RGB values are captured.
 TIME_OFFSET = 30 
 
-# Define points to be sampled in the center circle of the dosimeter for testing UV exposure levels.
-# testing = [(147, 110), (192, 110), (227, 148), (227, 190), (192, 227), (147, 227), (115, 190), (115, 148)]
-testing = []
-baseline = []
-base_rgb = []
+# Each sample point is the average of a SAMPLE_PATCH x SAMPLE_PATCH square around it (1 samples
+# single pixels). Cropped frames are sampled in batches of SAMPLE_BATCH frames.
+SAMPLE_PATCH = 1
+SAMPLE_BATCH = 64
 
 # Define the size ratio of the concentric circles on the dosimeter.
 inner_ratio = 0.56
 outer_ratio = 0.44
 
-vid_name = ""
+# Directory in which the <vid_name>_results folder of each video is created.
+OUTPUT_DIR = "."
 video_length = 0
 # Defines the number of samples which will be done when searching for the dosimeter.
 NUM_SAMPLES = 5
@@ -46,354 +117,1801 @@ B_UPPER = 250
 TOLERANCE = 25
 
 # Default values for the expected dosimeter size. If the dosimeter is not detected, modify these values.
-DOS_SIZE_SET = False
 DOS_MIN_SIZE = 100
 DOS_MAX_SIZE = 500
-DOS_WIDTH = 0
-DOS_HEIGHT = 0
-
-# Boolean function which determines whether or not the dosimeter is enclosed in a region.
-# Treating the center of the region of interest, ROI, as the the origin, The X and Y offsets
-# are used to probe the RGB values of the center and the four quadrants of the image. 
-# On average, more than half of the samples will be valid and within the yellow region. 
-# Potention TO DO: Change the RGB filtering to only central values; more accurate RBG range.
-def isDosimeter(ROI):
-
-    # Find the center of the image.
-    mid_x = ROI.shape[0] // 2
-    mid_y = ROI.shape[1] // 2
-    average = 0
-
-    # One sample will occur in each quadrant, as well as the center of the image.
-    x_cord = [mid_x, mid_x + X_OFF, mid_x + X_OFF, mid_x - X_OFF, mid_x - X_OFF]
-    y_cord = [mid_y, mid_y + Y_OFF, mid_y - Y_OFF, mid_y + Y_OFF, mid_y - Y_OFF]
-
-    for i in range(NUM_SAMPLES):
-        
-        # Try-except block is necessary to prevent array boundary exceptions
-        try:
-            b,g,r = ROI[x_cord[i], y_cord[i]] # Extract r,b,g values
-            # print(r, g, b) 
-        except:
-            return False
 
-        # There is likely a better implementation, but this works for checking each RBG pair
-        if (R_LOWER < r < R_UPPER):
-            if (G_LOWER < g < G_UPPER):
-                if (B_LOWER < b < B_UPPER):
-                    average += 1
+# Frames are downscaled by DETECT_SCALE to locate the dosimeter, which is then refined at full
+# resolution; colours are always sampled at full resolution. 1 disables downscaling and 0 picks
+# the factor from DOS_MIN_SIZE, keeping at least DETECT_MIN_PIXELS pixels across the dosimeter.
+DETECT_SCALE = 1
+DETECT_MIN_PIXELS = 50
+
+# Frames are processed in memory. Set to True to also write every extracted frame, its crop and
+# the origin images to disk for debugging; this is much slower on long videos.
+DEBUG_FRAMES = False
+
+# Dosimeter size limits restored before each video.
+DEFAULT_SIZE = (DOS_MIN_SIZE, DOS_MAX_SIZE)
+
+# Number of dosimeters analysed in each frame, e.g. several materials side by side in the chamber. They are
+# numbered in reading order (top to bottom, then left to right) in the origin frame, in which all of them must
+# be found, and each one gets its own locked size, sample points and baseline. In later frames, each dosimeter
+# is the candidate nearest to its last position. Each row then holds an R, G, B column group per dosimeter.
+# Tracking mode and the ROI cache only apply to a single dosimeter.
+DOSIMETERS = 1
+
+# Once the dosimeter has been found, tracking mode only searches a window around its previous
+# position and falls back to a full-frame search when it is not found there. This is intended
+# for steady (tripod) footage.
+TRACKING = False
+
+# Adaptive sampling (--mode adaptive) reads the scheduled frames every ADAPTIVE_STEP seconds, then bisects
+# the frames skipped between two readings, down to single frames, while any channel of the testing colour
+# changes by more than ADAPTIVE_THRESHOLD between them. Stable stretches are read sparsely and fast changes
+# frame by frame, so ADAPTIVE_THRESHOLD should be above the frame to frame noise of the readings.
+ADAPTIVE = False
+ADAPTIVE_STEP = 1.0
+ADAPTIVE_THRESHOLD = 4
+
+# With AUTO_CALIBRATE, a video in which the dosimeter is not found with the thresholds above is calibrated on
+# CALIBRATION_FRAMES frames spread over it (see calibration.py), and the calibrated colour and size thresholds
+# are used instead. They are saved to CALIBRATION_FILE ("" does not save them), which can be loaded for later
+# videos from the same rig.
+AUTO_CALIBRATE = False
+CALIBRATION_FRAMES = 8
+CALIBRATION_FILE = ""
+
+# Names of the settings copied by each Analyzer.
+SETTINGS = ["fps", "SEEK_THRESHOLD", "WORKERS", "DECODE_BACKEND", "FFMPEG_CROP_MARGIN", "PIPELINE_THREADS", "PIPELINE_QUEUE",
+    "RESULT_FORMATS", "AGGREGATE_SECONDS", "CHECKPOINT_FRAMES", "ROI_CACHE_DIR", "ROI_CACHE_BUDGET", "INSTRUMENT", "METRICS_INTERVAL", "LIVE_RATE",
+    "LIVE_LATENCY", "TIME_OFFSET", "SAMPLE_PATCH", "SAMPLE_BATCH", "inner_ratio", "outer_ratio", "OUTPUT_DIR", "NUM_SAMPLES",
+    "X_OFF", "Y_OFF", "R_LOWER", "R_UPPER", "G_LOWER", "G_UPPER", "B_LOWER", "B_UPPER", "TOLERANCE", "DETECT_SCALE",
+    "DETECT_MIN_PIXELS", "DEBUG_FRAMES", "DEFAULT_SIZE", "TRACKING", "ADAPTIVE", "ADAPTIVE_STEP", "ADAPTIVE_THRESHOLD",
+    "AUTO_CALIBRATE", "CALIBRATION_FRAMES", "CALIBRATION_FILE", "DOSIMETERS"]
+
+# Returns a new tracking state: the last bounding box of the dosimeter, the number of
+# frames processed and how many of them fell back to a full-frame search.
+def newTracker():
+    return {"box": None, "boxes": [], "frames": 0, "fallbacks": 0}
+
+# Returns whether two (x, y, w, h) boxes overlap.
+def boxesOverlap(box, other):
+    x, y, w, h = box
+    ox, oy, ow, oh = other
+    return x < ox + ow and ox < x + w and y < oy + oh and oy < y + h
 
-    # If over half of the samples are valid, the region is likely the dosimeter.
-    if (average > (NUM_SAMPLES // 2)):
-        return True
+def convertTime(secs):
+    mins = secs // 60
+    secs %= 60
+    return mins, secs
 
-    return False
+def average(list):
+    return sum(list)/len(list)
 
-# Boolean function which determines if a region is approximately the size of the dosimeter.
-# The expected size will be within the DOS_MIN_SIZE and DOS_MAX_SIZE squared.
-def in_size(ROI):
-    width, height,_ = ROI.shape # Extract region parameters
-    if (DOS_MIN_SIZE <= width <= DOS_MAX_SIZE):
-        if (DOS_MIN_SIZE <= height <= DOS_MAX_SIZE):
-            return True
-    return False
+# Converts a list of (x, y) sample points, as built by initSamples, into (rows, cols) index arrays.
+def sampleIndices(values):
+    cols = np.array([int(x) for x, _ in values], dtype=np.intp)
+    rows = np.array([int(y) for _, y in values], dtype=np.intp)
+    return rows, cols
 
-# Image processing function which crops each individual frame into purely the dosimeter.
-def processFrames(frameName, write):
-    # Read the frame into memory.
-    frame = cv2.imread(frameName, cv2.IMREAD_COLOR)
+# Returns a copy of the cropped region returned by processFrames (a list of regions with several dosimeters),
+# which no longer refers to the frame it was cropped from.
+def copyRegions(ROI):
+    if ROI is None:
+        return None
+    if isinstance(ROI, list):
+        return [copyRegions(region) for region in ROI]
+    return ROI.copy()
+
+# Copies a list of cropped dosimeter regions into one zero-padded (N, H, W, 3) array.
+# Returns the array and the (N, 2) array of the (height, width) of each region.
+def stackROIs(ROIs):
+    sizes = np.array([ROI.shape[:2] for ROI in ROIs], dtype=np.intp).reshape(-1, 2)
+    height, width = sizes.max(axis=0) if len(ROIs) > 0 else (0, 0)
+    batch = np.zeros((len(ROIs), height, width, 3), dtype=np.uint8)
+    for i, ROI in enumerate(ROIs):
+        batch[i, : ROI.shape[0], : ROI.shape[1]] = ROI
+    return batch, sizes
+
+# Samples the predetermined points of a batch of cropped dosimeter regions in one pass.
+# "batch" is an (N, H, W, 3) BGR array and "values" the (x, y) sample points. When "patch" is
+# larger than 1, each point is the mean of the patch x patch square around it (clipped to the
+# region), computed from integral images. "sizes" optionally holds the real (height, width) of
+# each region of a zero-padded batch (see stackROIs).
+# Returns an (N, 3) array of the rounded mean (r, g, b) of each region; regions which do not
+# contain every sample point are set to -1.
+def sampleBatch(batch, values, patch=1, sizes=None):
+    rows, cols = sampleIndices(values)
+    count, height, width, _ = batch.shape
+    if count == 0:
+        return np.zeros((0, 3), dtype=np.int64)
+    if sizes is None:
+        sizes = np.tile([height, width], (count, 1))
+
+    # Regions are only valid when all of the sample points fall inside of them.
+    valid = np.ones(count, dtype=bool)
+    if len(rows) > 0:
+        valid = (rows.min() >= 0) & (cols.min() >= 0) & (rows.max() < sizes[:, 0]) & (cols.max() < sizes[:, 1])
+    rows = np.clip(rows, 0, max(height - 1, 0))
+    cols = np.clip(cols, 0, max(width - 1, 0))
+
+    # Only the valid regions are sampled; the others (e.g. misses, cached with a (0, 0) size) are set to -1.
+    kept = np.flatnonzero(valid)
+    if len(kept) == 0:
+        return np.full((count, 3), -1, dtype=np.int64)
+    points = np.zeros((count, len(rows), 3))
+    if patch <= 1:
+        # (N, points, 3) pixel values at every sample point.
+        points[kept] = batch[kept[:, None], rows, cols]
+    else:
+        half = patch // 2
+        top = np.clip(rows - half, 0, None)
+        left = np.clip(cols - half, 0, None)
+        bottom = np.minimum(rows + patch - half, sizes[kept, :1])
+        right = np.minimum(cols + patch - half, sizes[kept, 1:])
+
+        # Integral image with a zero first row and column, over the area around the sample points only;
+        # any box sum then takes four lookups.
+        row0, row1 = int(top.min()), int(bottom.max())
+        col0, col1 = int(left.min()), int(right.max())
+        dtype = np.int32 if 255 * (row1 - row0) * (col1 - col0) < 2 ** 31 else np.int64
+        integral = np.zeros((len(kept), row1 - row0 + 1, col1 - col0 + 1, 3), dtype=dtype)
+        np.cumsum(batch[kept, row0 : row1, col0 : col1], axis=1, dtype=dtype, out=integral[:, 1:, 1:])
+        np.cumsum(integral[:, 1:, 1:], axis=2, out=integral[:, 1:, 1:])
+
+        top, bottom = top - row0, bottom - row0
+        left, right = left - col0, right - col0
+        frames = np.arange(len(kept))[:, None]
+        sums = (integral[frames, bottom, right] - integral[frames, top, right]
+            - integral[frames, bottom, left] + integral[frames, top, left]).astype(np.int64)
+        area = np.maximum((bottom - top) * (right - left), 1)
+        points[kept] = sums / area[:, :, None]
+
+    # Average the sample points of each region, and reorder BGR into RGB.
+    means = points.sum(axis=1) / len(values)
+    rgb = np.round(means[:, ::-1]).astype(np.int64)
+    rgb[~valid] = -1
+    return rgb
+
+# Counts the video packets of a file with ffprobe, without decoding them; returns 0 on failure.
+def probeFrameCount(filename):
+    if shutil.which("ffprobe") is None:
+        return 0
+    command = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-count_packets",
+        "-show_entries", "stream=nb_read_packets", "-of", "csv=p=0", filename]
+    try:
+        return int(subprocess.run(command, capture_output=True, text=True, check=True).stdout.strip())
+    except (subprocess.CalledProcessError, ValueError):
+        return 0
+
+# Reads the timestamps of the video packets of a file with ffmpeg, without decoding them. Returns the
+# timestamps in seconds, in presentation order and relative to the first frame, or None on failure.
+def probeFrameTimes(filename):
+    if not rawvideo.available():
+        return None
+    command = ["ffmpeg", "-v", "error", "-nostdin", "-i", filename, "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"]
+    try:
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    except subprocess.CalledProcessError:
+        return None
 
-    # Verify frame has been correctly read
-    if (frame is None):
-        print("Invalid file path for sample image.")
-        # TO DO: Potentially add error handling.
+    # Lines are "stream, dts, pts, duration, size, checksum", after a header giving the time base.
+    numerator, denominator = 1, 1
+    stamps = []
+    for line in output.splitlines():
+        if line.startswith("#tb 0:"):
+            numerator, denominator = (int(value) for value in line.split(":")[1].split("/"))
+        elif not line.startswith("#"):
+            pts = int(line.split(",")[2])
+            if pts != NO_PTS:
+                stamps.append(pts)
+    if not stamps:
+        return None
+    stamps = np.sort(np.array(stamps, dtype=np.int64))
+    return (stamps - stamps[0]) * numerator / denominator
+
+# Timestamp ffmpeg gives a packet without one.
+NO_PTS = -(1 << 63)
+
+# Frames whose timestamps are checked for a variable frame rate when ffmpeg is not installed (see Analyzer.frameTimes).
+VFR_PROBE_FRAMES = 300
+
+# Reads the timestamps OpenCV gives the frames of an opened video, in seconds relative to its first frame;
+# when "count" is set, only those of the first "count" frames. The frames are grabbed, not converted.
+def captureTimes(video, count=0):
+    video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    times = []
+    while ((count <= 0 or len(times) < count) and video.grab()):
+        times.append(video.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+    times = np.array(times)
+    return times - times[0] if len(times) else None
+
+# Returns whether the timestamps of the frames of a video follow the frame "rate" to within half a frame.
+def constantRate(times, rate):
+    return np.abs(times - np.arange(len(times)) / rate).max() <= 0.5 / rate
+
+# Returns the (minute, second, frame) label of a frame index; the frame number counts from 1
+# within each second of the video. The seconds come from the "times" of the frames of a video with
+# a variable frame rate (see Analyzer.frameTimes), and from the constant frame rate otherwise.
+def frameLabel(index, rate, times=None):
+    if (times is None or index >= len(times)):
+        total_seconds = math.floor(index / rate)
+        count = index - math.ceil(total_seconds * rate) + 1
+    else:
+        total_seconds = math.floor(times[index])
+        count = index - int(np.searchsorted(times, total_seconds)) + 1
+    minute, second = convertTime(total_seconds)
+    return minute, second, count
+
+# Returns the (width, height) of the frames of an opened video.
+def frameSize(video):
+    return int(video.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+# Returns the statistics of one pipeline queue: the depth seen on every get, and the time the
+# producers spent blocked on a full queue and the consumers blocked on an empty one.
+# Several threads share a queue, so the counters are only updated while holding "lock".
+def newQueueStats(name):
+    return {"name": name, "gets": 0, "depth_total": 0, "depth_max": 0, "put_wait": 0.0, "get_wait": 0.0,
+        "lock": threading.Lock()}
+
+# Seconds a blocked pipeline stage waits on a queue before checking whether the pipeline was stopped.
+QUEUE_POLL = 0.1
+
+# Puts an item on a bounded queue, blocking while it is full (backpressure).
+# Returns False, without putting the item, once the "stop" event is set.
+def queuePut(queue_, stats, item, stop):
+    start = time.perf_counter()
+    try:
+        while not stop.is_set():
+            try:
+                queue_.put(item, timeout=QUEUE_POLL)
+                return True
+            except queue.Full:
+                pass
         return False
-
-    # Convert the original image into grayscale, and apply OTSU filtering to it.
-    frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    _, threshold = cv2.threshold(frame_gray, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)
-
-    # Find the contours within the image.
-    contours,_ = cv2.findContours(threshold, cv2.RETR_TREE,cv2.CHAIN_APPROX_SIMPLE)
-
-    # Sort the contours based on area; returns a list with descending contour areas.
-    contours = sorted(contours, key=cv2.contourArea, reverse=True)
-
-    # Loop through all the contours to find the dosimeter.
-    found_contour = False
-    
-    for c in contours:
-        # Extract the region enclosing a specific contour.
-        x,y,w,h = cv2.boundingRect(c)
+    finally:
+        with stats["lock"]:
+            stats["put_wait"] += time.perf_counter() - start
+
+# Gets an item from a queue, recording the queue depth at that point.
+# Returns None once the "stop" event is set.
+def queueGet(queue_, stats, stop):
+    depth = queue_.qsize()
+    with stats["lock"]:
+        stats["gets"] += 1
+        stats["depth_total"] += depth
+        stats["depth_max"] = max(stats["depth_max"], depth)
+    start = time.perf_counter()
+    try:
+        while not stop.is_set():
+            try:
+                return queue_.get(timeout=QUEUE_POLL)
+            except queue.Empty:
+                pass
+        return None
+    finally:
+        with stats["lock"]:
+            stats["get_wait"] += time.perf_counter() - start
+
+def printQueueStats(stats):
+    mean = stats["depth_total"] / max(stats["gets"], 1)
+    print("{} queue: mean depth {:.1f}, max depth {}, producers blocked {:.2f}s, consumers blocked {:.2f}s".format(
+        stats["name"], mean, stats["depth_max"], stats["put_wait"], stats["get_wait"]))
+
+# Number of segments given to each worker process, so faster workers can pick up more of them.
+SEGMENTS_PER_WORKER = 4
+
+# Returns a fingerprint of a video file: its size and a hash of its first and last megabyte.
+def videoFingerprint(filename):
+    size = os.path.getsize(filename)
+    digest = hashlib.sha1()
+    with open(filename, "rb") as video_file:
+        digest.update(video_file.read(1 << 20))
+        video_file.seek(max(size - (1 << 20), 0))
+        digest.update(video_file.read(1 << 20))
+    return {"size": size, "sha1": digest.hexdigest()}
+
+# Opens a live source: a device index (e.g. "0"), or a file, pipe or stream URL understood by OpenCV.
+def openSource(source):
+    if str(source).isdigit():
+        return cv2.VideoCapture(int(source))
+    return cv2.VideoCapture(source)
+
+# Returns the name under which the results of a live source are written.
+def sourceName(source):
+    if str(source).isdigit():
+        return "camera" + str(source)
+    return path.splitext(path.basename(str(source).rstrip("/")))[0] or "live"
+
+# Analyses dosimeter videos. An Analyzer holds its own copy of the settings above, as attributes of the
+# same names, which may be overridden when it is created, e.g. Analyzer(TIME_OFFSET=0, TRACKING=True).
+# It also holds the state of the video it analyses: the locked dosimeter size, the sample points and the
+# baseline values. Analyzers share no state, so several videos can be analysed at once in threads of
+# the same process, each with its own Analyzer. An Analyzer analyses one video at a time; analyzeFrame
+# may be called from several threads.
+class Analyzer:
+    def __init__(self, **settings):
+        for name in SETTINGS:
+            setattr(self, name, copy.deepcopy(globals()[name]))
+        for name, value in settings.items():
+            if name not in SETTINGS:
+                raise TypeError("Unknown setting {}".format(name))
+            setattr(self, name, value)
+
+        # "lock" guards the locking of the dosimeter geometry, "running" the analysis of a whole video.
+        self.lock = threading.Lock()
+        self.running = threading.Lock()
+        # Timestamps of the frames of the video analysed, when its frame rate varies (see frameTimes).
+        self.frame_times = None
+        self.resetVideo("")
+
+    # Analyzers are sent to worker processes without their locks and metrics.
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["lock"], state["running"]
+        state["METRICS"] = metrics.NullMetrics()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self.running = threading.Lock()
+
+    # Returns the detector limits (see detector.makeLimits) from the current size and colour constants.
+    def detectorLimits(self):
+        return detector.makeLimits(self.DOS_MIN_SIZE, self.DOS_MAX_SIZE, (self.R_LOWER, self.G_LOWER, self.B_LOWER), (self.R_UPPER, self.G_UPPER, self.B_UPPER),
+            self.X_OFF, self.Y_OFF, self.NUM_SAMPLES)
+
+    # Boolean function which determines whether or not the dosimeter is enclosed in a region.
+    # Treating the center of the region of interest, ROI, as the the origin, The X and Y offsets
+    # are used to probe the RGB values of the center and the four quadrants of the image. 
+    # On average, more than half of the samples will be valid and within the yellow region. 
+    # "scale" is the factor the ROI has been downscaled by; the offsets are scaled with it.
+    def isDosimeter(self, ROI, scale=1):
+        box = (0, 0, ROI.shape[1], ROI.shape[0])
+        return bool(detector.colourTest(ROI, [box], detector.scaleLimits(self.detectorLimits(), scale))[0])
+
+    # Boolean function which determines if a region is approximately the size of the dosimeter.
+    # The expected size will be within the DOS_MIN_SIZE and DOS_MAX_SIZE squared.
+    # For an ROI downscaled by "scale", the limits are scaled and widened by a pixel of rounding.
+    def in_size(self, ROI, scale=1):
+        box = (0, 0, ROI.shape[1], ROI.shape[0])
+        return bool(detector.sizeTest([box], detector.scaleLimits(self.detectorLimits(), scale))[0])
+
+    # Returns the factor frames are downscaled by for detection. DETECT_SCALE = 0 picks it
+    # automatically, so that the smallest expected dosimeter still spans DETECT_MIN_PIXELS pixels.
+    def detectScale(self):
+        if self.DETECT_SCALE > 0:
+            return self.DETECT_SCALE
+        return max(self.DOS_MIN_SIZE // self.DETECT_MIN_PIXELS, 1)
+
+    # Searches an image for the dosimeter; returns the (x, y, w, h) bounding box of the region
+    # enclosing it, or None if no region passes the size and colour checks.
+    def findDosimeter(self, image, scale=None):
+        return next(self.locateCandidates(image, scale), None)
+
+    # Generator of the (x, y, w, h) bounding boxes of the dosimeter candidates of an image, largest first.
+    # Unless "scale" is 1, candidates are located on a downscaled copy of the image (see detectScale),
+    # and each candidate is refined on the full-resolution image in a window around it, when it is reached;
+    # candidates which do not pass there are skipped.
+    def locateCandidates(self, image, scale=None):
+        if scale is None:
+            scale = self.detectScale()
+        if scale <= 1:
+            boxes = self.findCandidates(image)
+            self.METRICS.observe("candidates", len(boxes))
+            yield from boxes
+            return
+
+        # Bilinear resizing only reads a few pixels per output pixel, unlike INTER_AREA, which reads them all.
+        small = cv2.resize(image, None, fx=1 / scale, fy=1 / scale, interpolation=cv2.INTER_LINEAR)
+        margin = self.TOLERANCE + 2 * scale
+        candidates = self.findCandidates(small, scale)
+        self.METRICS.observe("candidates", len(candidates))
+        for x, y, w, h in candidates:
+            # Window around the candidate in full-resolution coordinates.
+            x0 = max(int(x * scale - margin), 0)
+            y0 = max(int(y * scale - margin), 0)
+            x1 = min(int((x + w) * scale + margin), image.shape[1])
+            y1 = min(int((y + h) * scale + margin), image.shape[0])
+
+            boxes = self.findCandidates(image[y0 : y1, x0 : x1])
+            if boxes:
+                x, y, w, h = boxes[0]
+                yield x + x0, y + y0, w, h
+
+    # Returns the (x, y, w, h) bounding boxes of the regions in an image which pass the size and
+    # colour checks, from the largest contour to the smallest. "scale" is the factor the image has
+    # been downscaled by.
+    def findCandidates(self, image, scale=1):
+        return detector.findCandidates(image, self.detectorLimits(), scale)
+
+    # Returns the (x0, y0, x1, y1) search window around the previous bounding box in tracking mode.
+    # The window is centred on the previous box and sized from the locked dosimeter size, so the
+    # dosimeter may move by about TOLERANCE pixels between frames.
+    def trackingWindow(self, box, shape):
+        x, y, w, h = box
+        side = self.DOS_MAX_SIZE + 2 * self.TOLERANCE
+        x0 = max(x + w // 2 - side // 2, 0)
+        y0 = max(y + h // 2 - side // 2, 0)
+        x1 = min(x0 + side, shape[1])
+        y1 = min(y0 + side, shape[0])
+        return x0, y0, x1, y1
+
+    # Image processing function which crops each individual frame into purely the dosimeter.
+    # "frame" is the BGR image array returned by VideoCapture.read(); the cropped dosimeter
+    # region is returned as an array (a view into the frame), or None if it was not found.
+    # "name" is only used for messages and for the optional debug images.
+    # In tracking mode, the search is restricted to a window around the dosimeter's last position
+    # in "tracker" (TRACKER by default) and only falls back to the full frame when that fails.
+    # With several DOSIMETERS, a list of the regions is returned instead (see processDosimeters).
+    def processFrames(self, frame, name="", tracker=None):
+        # Verify frame has been correctly read
+        if (frame is None):
+            print("Invalid frame passed for processing.")
+            # TO DO: Potentially add error handling.
+            return None
+
+        if self.DOSIMETERS > 1:
+            return self.processDosimeters(frame, name, tracker)
+
+        if tracker is None:
+            tracker = self.TRACKER
+        tracker["frames"] += 1
+        start = self.METRICS.clock()
+
+        box = None
+        if (self.TRACKING == True and self.DOS_SIZE_SET == True and tracker["box"] is not None):
+            x0, y0, x1, y1 = self.trackingWindow(tracker["box"], frame.shape)
+            box = self.findDosimeter(frame[y0 : y1, x0 : x1])
+            if box is not None:
+                x, y, w, h = box
+                box = (x + x0, y + y0, w, h)
+            else:
+                tracker["fallbacks"] += 1
+                self.METRICS.count("tracking_fallbacks")
+
+        # Search the full frame for the dosimeter.
+        if box is None:
+            box = self.findDosimeter(frame)
+
+        # Terminate program if contour is not found.
+        # Feel free to comment out to prevent terminal spam.
+        if box is None:
+            self.METRICS.count("misses")
+            self.METRICS.timed("detect_seconds", start)
+            print("ERROR: Contour was not found in {}".format(name))
+            # print("Consider modifying of RBG constants or Dosimeter size constants at top of file.")
+            # print("Current frame will be skipped.\n")
+            return None
+
+        tracker["box"] = box
+        x,y,w,h = box
         ROI = frame[y : y + h, x : x + w]
 
-        if in_size(ROI) and isDosimeter(ROI):
-            found_contour = True
-
-            global DOS_SIZE_SET, DOS_MIN_SIZE, DOS_MAX_SIZE, DOS_HEIGHT, DOS_WIDTH
-            if DOS_SIZE_SET == False:
-                print("Set the dosimeter!")
-                width, height,_ = ROI.shape
-                DOS_MIN_SIZE = min(width, height) - TOLERANCE
-                DOS_MAX_SIZE = max(width, height) + TOLERANCE
-                DOS_SIZE_SET = True
-                cv2.imwrite("Origin_cropped.jpg", ROI)
-            
-            if DOS_WIDTH == 0 and DOS_HEIGHT == 0:
-                DOS_WIDTH, DOS_HEIGHT,_ = ROI.shape
-
-            break
-
-    # Terminate program if contour is not found.
-    # Feel free to comment out to prevent terminal spam.
-    if found_contour == False:
-        print("ERROR: Contour was not found in {}".format(frameName))
-        # print("Consider modifying of RBG constants or Dosimeter size constants at top of file.")
-        # print("Current frame will be skipped.\n")
-        return False
-
-    if (write == True):
-        cv2.imwrite(frameName, ROI)
+        # The size is locked by the first frame in which the dosimeter is found, even across threads.
+        if self.DOS_SIZE_SET == False:
+            with self.lock:
+                if self.DOS_SIZE_SET == False:
+                    print("Set the dosimeter!")
+                    width, height,_ = ROI.shape
+                    self.DOS_MIN_SIZE = min(width, height) - self.TOLERANCE
+                    self.DOS_MAX_SIZE = max(width, height) + self.TOLERANCE
+                    if self.DOS_WIDTH == 0 and self.DOS_HEIGHT == 0:
+                        self.DOS_WIDTH, self.DOS_HEIGHT,_ = ROI.shape
+                    self.DOS_SIZE_SET = True
+                    if self.DEBUG_FRAMES:
+                        self.writeDebugImage(os.path.join(self.resultsDir(), "Origin_cropped.jpg"), ROI)
+
+        self.METRICS.count("detections")
+        self.METRICS.timed("detect_seconds", start)
+
+        # Only write the cropped frame to disk when debugging.
+        if (self.DEBUG_FRAMES == True and name != ""):
+            self.writeDebugImage(name, ROI)
     
-    return True
-
-# Dosimeter size parameters initialization function.
-# Depending on how the video is shot and where the dosimeter is within it, the number of pixels 
-# describing the size of the dosimeter may vary. This function will process the first valid frame
-# of the video and update the size constants to the current value of the dosimeter.
-def initDosSize(filename):
-    try:
-        video = cv2.VideoCapture(filename)
-    except:
-        print("ERROR: Unable to open video {}".format(filename))
-        print("Terminating program...")
-        sys.exit(0)
-
-    # A simple way to skip x seconds into a video is by reading the first
-    # FPS * TIME_OFFSET images and ignoring them.
-    frames_skipped = fps * TIME_OFFSET
-    current_frame = 0
+        return ROI
+
+    # Returns the (x, y, w, h) boxes of every dosimeter found in an image, largest first, without any box which
+    # overlaps a larger one. Candidates are located as in findDosimeter (see locateCandidates).
+    def findDosimeters(self, image):
+        found = []
+        for box in self.locateCandidates(image):
+            if not any(boxesOverlap(box, other) for other in found):
+                found.append(box)
+        return found
+
+    # Several dosimeters version of processFrames: returns a list with the cropped region of each dosimeter,
+    # in their order, and None for those not found. Until the dosimeters have been locked in the origin frame,
+    # in which all of them must be found, None is returned instead of the list. Each dosimeter is kept in
+    # one of the "dosimeters" Analyzers, which holds its locked size, sample points and baseline.
+    def processDosimeters(self, frame, name="", tracker=None):
+        if tracker is None:
+            tracker = self.TRACKER
+        tracker["frames"] += 1
+        start = self.METRICS.clock()
+        boxes = self.findDosimeters(frame)
+
+        # The sizes are locked by the first frame in which all of the dosimeters are found, even across threads.
+        if self.DOS_SIZE_SET == False:
+            with self.lock:
+                if self.DOS_SIZE_SET == False:
+                    if len(boxes) < self.DOSIMETERS:
+                        self.METRICS.count("misses")
+                        self.METRICS.timed("detect_seconds", start)
+                        print("ERROR: Only {} of {} dosimeters were found in {}".format(len(boxes), self.DOSIMETERS, name))
+                        return None
+
+                    # Number the dosimeters in reading order, in rows as tall as the tallest of them.
+                    boxes = boxes[: self.DOSIMETERS]
+                    row_height = max(h for _, _, _, h in boxes)
+                    boxes.sort(key=lambda box: ((box[1] + box[3] // 2) // row_height, box[0]))
+                    print("Set the {} dosimeters!".format(self.DOSIMETERS))
+                    for dosimeter, (x, y, w, h) in zip(self.dosimeters, boxes):
+                        dosimeter.DOS_MIN_SIZE = min(w, h) - self.TOLERANCE
+                        dosimeter.DOS_MAX_SIZE = max(w, h) + self.TOLERANCE
+                        # As in processFrames, which takes them from ROI.shape.
+                        dosimeter.DOS_WIDTH, dosimeter.DOS_HEIGHT = h, w
+                        dosimeter.DOS_SIZE_SET = True
+
+                    # Candidates are searched for with limits which fit all of the dosimeters.
+                    self.DOS_MIN_SIZE = min(dosimeter.DOS_MIN_SIZE for dosimeter in self.dosimeters)
+                    self.DOS_MAX_SIZE = max(dosimeter.DOS_MAX_SIZE for dosimeter in self.dosimeters)
+                    self.TRACKER["boxes"] = list(boxes)
+                    self.DOS_SIZE_SET = True
+        if not tracker["boxes"]:
+            tracker["boxes"] = list(self.TRACKER["boxes"])
+
+        ROIs = []
+        for i, box in enumerate(self.matchDosimeters(boxes, tracker["boxes"])):
+            if box is None:
+                self.METRICS.count("misses")
+                print("ERROR: Dosimeter {} was not found in {}".format(i + 1, name))
+                ROIs.append(None)
+                continue
 
-    # Offset the video by TIME_OFFSET seconds.
-    while current_frame < frames_skipped:
-        _,_ = video.read() # Ignore the current image
-        current_frame += 1 
+            tracker["boxes"][i] = box
+            x,y,w,h = box
+            ROI = frame[y : y + h, x : x + w]
+            self.METRICS.count("detections")
+            if (self.DEBUG_FRAMES == True and name != ""):
+                self.writeDebugImage("{}_{}{}".format(path.splitext(name)[0], i + 1, path.splitext(name)[1]), ROI)
+            ROIs.append(ROI)
+
+        self.METRICS.timed("detect_seconds", start)
+        return ROIs
+
+    # Matches the boxes found in a frame to the dosimeters, whose last boxes are "previous". Each dosimeter
+    # is given the nearest box within its locked size, closest pairs first; a box more than the dosimeter's
+    # size away from its last position is not that dosimeter. Returns a box (or None) per dosimeter.
+    def matchDosimeters(self, boxes, previous):
+        pairs = []
+        for i, (dosimeter, (px, py, pw, ph)) in enumerate(zip(self.dosimeters, previous)):
+            for j, (x, y, w, h) in enumerate(boxes):
+                distance = math.hypot(x + w / 2 - px - pw / 2, y + h / 2 - py - ph / 2)
+                if (detector.sizeTest([(x, y, w, h)], dosimeter.detectorLimits())[0] and distance <= dosimeter.DOS_MAX_SIZE):
+                    pairs.append((distance, i, j))
+
+        matched = [None] * len(previous)
+        used = set()
+        for _, i, j in sorted(pairs):
+            if matched[i] is None and j not in used:
+                matched[i] = boxes[j]
+                used.add(j)
+        return matched
+
+    # Writes a debug image (see DEBUG_FRAMES).
+    def writeDebugImage(self, filename, image):
+        start = self.METRICS.clock()
+        cv2.imwrite(filename, image)
+        self.METRICS.timed("debug_write_seconds", start)
+
+    # Dosimeter size parameters initialization function.
+    # Depending on how the video is shot and where the dosimeter is within it, the number of pixels 
+    # describing the size of the dosimeter may vary. This function will process the first valid frame
+    # of the video and update the size constants to the current value of the dosimeter.
+    def initDosSize(self, filename):
+        try:
+            video = cv2.VideoCapture(filename)
+        except:
+            print("ERROR: Unable to open video {}".format(filename))
+            print("Terminating program...")
+            sys.exit(0)
+
+        # Seek TIME_OFFSET seconds into the video and capture the first "valid" frame.
+        rate = self.videoFps(video)
+        success = False
+        for _, origin_frame in self.readFrames(video, [self.offsetFrames(rate)]):
+            success = True
+        video.release()
+        if (success == False):
+            return False
 
-    # Capture the first "valid" frame of the video.
-    success,origin_frame = video.read()
-    cv2.imwrite("origin_frame.jpg", origin_frame)
+        origin_name = os.path.join(self.resultsDir(), "origin_frame.jpg")
+        if self.DEBUG_FRAMES:
+            os.makedirs(self.resultsDir(), exist_ok=True)
+            self.writeDebugImage(origin_name, origin_frame)
 
-    processFrames("origin_frame.jpg", True)
+        # Keep the cropped origin frame in memory; the baseline values are sampled from it.
+        self.ORIGIN_ROI = self.processFrames(origin_frame, origin_name)
 
-    if (DOS_SIZE_SET == True):
-        return True
+        if (self.DOS_SIZE_SET == True and self.ORIGIN_ROI is not None):
+            return True
 
-    return False
+        return False
 
-def initSamples():
-    # Assumes the sizes are valid, since the initDosSize function will cause program to terminate
-    # if the dosimeter was not found prior.
+    def initSamples(self):
+        # Assumes the sizes are valid, since the initDosSize function will cause program to terminate
+        # if the dosimeter was not found prior.
     
-    # Testing is a list of tuples corresponding to all the points RGB values will be sampled.
-    global testing, baseline
-    tolerance = math.floor((DOS_WIDTH + DOS_HEIGHT) / 20) # Average, w and h and divide by 10.
-    w_center = DOS_WIDTH // 2
-    h_center = DOS_HEIGHT // 2
+        # Testing is a list of tuples corresponding to all the points RGB values will be sampled.
+        tolerance = math.floor((self.DOS_WIDTH + self.DOS_HEIGHT) / 20) # Average, w and h and divide by 10.
+        w_center = self.DOS_WIDTH // 2
+        h_center = self.DOS_HEIGHT // 2
 
-    inner_diam = inner_ratio * (DOS_WIDTH + DOS_HEIGHT) // 4
-    outer_width = outer_ratio * (DOS_WIDTH + DOS_HEIGHT) // 8
-    outer_offset = DOS_WIDTH - outer_width
+        inner_diam = self.inner_ratio * (self.DOS_WIDTH + self.DOS_HEIGHT) // 4
+        outer_width = self.outer_ratio * (self.DOS_WIDTH + self.DOS_HEIGHT) // 8
+        outer_offset = self.DOS_WIDTH - outer_width
 
-    testing_x_pos =  [w_center, w_center, w_center + inner_diam - tolerance, w_center, w_center - inner_diam + tolerance]
-    testing_y_pos = [h_center, h_center - inner_diam + tolerance, h_center, h_center + inner_diam - tolerance, h_center]
+        testing_x_pos =  [w_center, w_center, w_center + inner_diam - tolerance, w_center, w_center - inner_diam + tolerance]
+        testing_y_pos = [h_center, h_center - inner_diam + tolerance, h_center, h_center + inner_diam - tolerance, h_center]
 
-    baseline_x_pos = [outer_width, outer_width + tolerance, outer_width + (2 * tolerance), outer_width + (3 * tolerance), 
-    outer_offset, outer_offset - tolerance, outer_offset - (2 * tolerance), outer_offset - (3 * tolerance)]
+        baseline_x_pos = [outer_width, outer_width + tolerance, outer_width + (2 * tolerance), outer_width + (3 * tolerance), 
+        outer_offset, outer_offset - tolerance, outer_offset - (2 * tolerance), outer_offset - (3 * tolerance)]
     
-    baseline_y_pos = [h_center + tolerance, h_center + (2 * tolerance), h_center + (3 * tolerance), h_center + (4 * tolerance),
-    h_center + tolerance, h_center + (2 * tolerance), h_center + (3 * tolerance), h_center + (4 * tolerance)]
+        baseline_y_pos = [h_center + tolerance, h_center + (2 * tolerance), h_center + (3 * tolerance), h_center + (4 * tolerance),
+        h_center + tolerance, h_center + (2 * tolerance), h_center + (3 * tolerance), h_center + (4 * tolerance)]
 
-    # List includes the sample points for both the inner circle and outer ring.
-    # x_pos =  [w_center, w_center, w_center + inner_diam - tolerance, w_center, w_center - inner_diam + tolerance,
-    # outer_width, outer_width + tolerance, outer_width + (2 * tolerance), outer_width + (3 * tolerance), 
-    # outer_offset, outer_offset - tolerance, outer_offset - (2 * tolerance), outer_offset - (3 * tolerance)]
+        # List includes the sample points for both the inner circle and outer ring.
+        # x_pos =  [w_center, w_center, w_center + inner_diam - tolerance, w_center, w_center - inner_diam + tolerance,
+        # outer_width, outer_width + tolerance, outer_width + (2 * tolerance), outer_width + (3 * tolerance), 
+        # outer_offset, outer_offset - tolerance, outer_offset - (2 * tolerance), outer_offset - (3 * tolerance)]
     
-    # y_pos = [h_center, h_center - inner_diam + tolerance, h_center, h_center + inner_diam - tolerance, h_center,
-    # h_center + tolerance, h_center + (2 * tolerance), h_center + (3 * tolerance), h_center + (4 * tolerance),
-    # h_center + tolerance, h_center + (2 * tolerance), h_center + (3 * tolerance), h_center + (4 * tolerance)]
+        # y_pos = [h_center, h_center - inner_diam + tolerance, h_center, h_center + inner_diam - tolerance, h_center,
+        # h_center + tolerance, h_center + (2 * tolerance), h_center + (3 * tolerance), h_center + (4 * tolerance),
+        # h_center + tolerance, h_center + (2 * tolerance), h_center + (3 * tolerance), h_center + (4 * tolerance)]
 
-    test_samples = len(testing_y_pos)
-    baseline_samples = len(baseline_x_pos)
+        test_samples = len(testing_y_pos)
+        baseline_samples = len(baseline_x_pos)
 
-    print("(X,Y) points which will sample the dosimeter.")
-    for i in range(test_samples):
-        testing.append((testing_x_pos[i], testing_y_pos[i]))
-        print(testing[i])
-
-    print()
-    
-    print ("(X, Y) points which will sample the baseline value of the dosimeter")
-    for i in range(baseline_samples):
-        baseline.append((baseline_x_pos[i], baseline_y_pos[i]))
-        print(baseline[i])
-    return
-
-def getPixelColor(image_name, x, y):
-    # Create a PIL.Image object
-    try:
-        image = Image.open(image_name)
-    except IOError:
-        return None
+        # The points replace any placed before, e.g. for a previous video.
+        self.testing = []
+        self.baseline = []
 
-    # Convert to RGB colorspace
-    image_rgb = image.convert("RGB")
+        print("(X,Y) points which will sample the dosimeter.")
+        for i in range(test_samples):
+            self.testing.append((testing_x_pos[i], testing_y_pos[i]))
+            print(self.testing[i])
 
-    # Get color from (x, y) coordinates
-    w = int(x)
-    h = int(y)
-    if (w < 0 or w >= DOS_WIDTH):
-        return -1, -1, -1
-    if (h < 0 or h >= DOS_HEIGHT):
-        return -1, -1, -1
-
-    r, g, b = image_rgb.getpixel((int(x),int(y)))
-    return 
-
-def convertTime(secs):
-    mins = secs // 60
-    secs %= 60
-    return mins, secs
-
-def average(list):
-    return sum(list)/len(list)
-
-def sampleColor(image_name, values):
-    # Create a PIL.Image object
-    try:
-        image = Image.open(image_name)
-    except IOError:
-        print("Error in sampleColor(): Image: {} was not found.".format(image_name))
-        return None
-
-    # Convert to RGB colorspace
-    image_rgb = image.convert("RGB")
-
-    red = []
-    green = []
-    blue = []
-
-    # Loop over the predetermined sample points and append rgb values to list.
-    for x, y in values:
-        r, g, b = image_rgb.getpixel((int(x),int(y)))
-        red.append(r)
-        green.append(g)
-        blue.append(b)
-
-    # Average the rgb values for each sample point.
-    red_val = round(average(red))
-    green_val = round(average(green))
-    blue_val = round(average(blue))
-
-    return red_val, green_val, blue_val
-
-# Function to extract frames
-# "filename" is a string that contains the name of the video file to be processed
-# "filter" is a boolean that denotes whether to filter frames or not
-# When filter = 1, only the frames from each 10th second are captured (Ex 30 frames @ 0, 10, 20 30, etc.)
-# When filter = 0, all frames are captured
-def getTheFrames(filename, filter):
-    # Path to video file
-    video = cv2.VideoCapture(filename)
-
-    # Used as counter variables
-    count = 1
-    second = 0
-    minute = 0
-    framecount = 0
-    frame_offset= fps* TIME_OFFSET
-
-    # success fiend shows whether a frame was correctly extracted
-    success = 1
-
-    # Create a local directory storing all of the frames for a given test.
-    try:
-        os.mkdir(vid_name + "_results")
-    except:
-        pass # If the file exists, its fine.
-
-    # Change to the created directory.
-    os.chdir(vid_name + "_results")
+        print()
     
-    # Open the csv file.
-    data_file = vid_name + ".csv"
-
-    # Create/open the csv file for writing.
-    with open(data_file, "w") as csvfile:
-        file_writer = csv.writer(csvfile, delimiter=",", quotechar="|", quoting=csv.QUOTE_MINIMAL)
-        file_writer.writerow(["Baseline RGB values:", "R", "G", "B"])
-        file_writer.writerow(["", base_rgb[0], base_rgb[1], base_rgb[2]])
-        file_writer.writerow(["Minute", "Second", "Frame", "R", "G", "B"])
-        
-        while success:
-            # vidObj object calls read function to extract a singular frame
-            success, image = video.read()
-
-            # Set bounds on frames between 1 and 30, wrapping back to 1
-            if (count > fps):
-                second += 1
-                count = 1
+        print ("(X, Y) points which will sample the baseline value of the dosimeter")
+        for i in range(baseline_samples):
+            self.baseline.append((baseline_x_pos[i], baseline_y_pos[i]))
+            print(self.baseline[i])
+        return
+
+    # Returns the folder in which the results of the current video are written.
+    def resultsDir(self):
+        return os.path.join(self.OUTPUT_DIR, self.vid_name + "_results")
+
+    # Samples the predetermined points of a cropped dosimeter region.
+    # "ROI" is a BGR image array as returned by processFrames; the averaged (r, g, b) is returned,
+    # or (-1, -1, -1) if a sample point falls outside of the region.
+    def sampleColor(self, ROI, values, patch=1):
+        if (ROI is None):
+            print("Error in sampleColor(): No image was provided.")
+            return None
+
+        start = self.METRICS.clock()
+        r, g, b = sampleBatch(ROI[np.newaxis], values, patch)[0]
+        self.METRICS.count("frames_sampled")
+        self.METRICS.timed("sample_seconds", start)
+        return int(r), int(g), int(b)
+
+    # Samples a batch of (label, ROI) pairs in one pass and returns a CSV row for each of them,
+    # in order. Frames in which the dosimeter was not found (ROI is None) are given -1.
+    # The regions are also added to "roi_writer" (a roicache.CacheWriter), when one is given.
+    # With several DOSIMETERS, each row holds the r, g, b values of every dosimeter in turn.
+    def sampleRows(self, pending, roi_writer=None):
+        if self.DOSIMETERS > 1:
+            return self.sampleDosimeters(pending)
+        if roi_writer is not None:
+            for label, ROI in pending:
+                roi_writer.write(label[0], ROI)
+
+        start = self.METRICS.clock()
+        ROIs = [ROI for _, ROI in pending if ROI is not None]
+        batch, sizes = stackROIs(ROIs)
+        samples = iter(sampleBatch(batch, self.testing, self.SAMPLE_PATCH, sizes))
+        self.METRICS.count("frames_sampled", len(ROIs))
+        self.METRICS.timed("sample_seconds", start)
+
+        rows = []
+        for label, ROI in pending:
+            if ROI is None:
+                rows.append(label + [-1, -1, -1])
+            else:
+                r, g, b = next(samples)
+                rows.append(label + [int(r), int(g), int(b)])
+        return rows
+
+    # Several dosimeters version of sampleRows: each dosimeter's regions are sampled in one batch with its own
+    # sample points. "pending" holds lists of regions, as returned by processDosimeters.
+    def sampleDosimeters(self, pending):
+        rows = [list(label) for label, _ in pending]
+        for i, dosimeter in enumerate(self.dosimeters):
+            start = self.METRICS.clock()
+            ROIs = [ROI[i] for _, ROI in pending if ROI is not None and ROI[i] is not None]
+            batch, sizes = stackROIs(ROIs)
+            samples = iter(sampleBatch(batch, dosimeter.testing, self.SAMPLE_PATCH, sizes))
+            self.METRICS.count("frames_sampled", len(ROIs))
+            self.METRICS.timed("sample_seconds", start)
+
+            for row, (_, ROI) in zip(rows, pending):
+                if ROI is None or ROI[i] is None:
+                    row += [-1, -1, -1]
+                else:
+                    r, g, b = next(samples)
+                    row += [int(r), int(g), int(b)]
+        return rows
+
+    # Returns the frame rate reported by the video container, falling back to the fps setting.
+    def videoFps(self, video):
+        rate = video.get(cv2.CAP_PROP_FPS)
+        if (rate is None or rate <= 0 or math.isnan(rate)):
+            return self.fps
+        return rate
+
+    # Returns the frame rate, the number of frames and the duration in seconds of an opened video.
+    # These come from the capture itself; when the container does not report a frame count, the
+    # frames are counted with ffprobe if it is installed (0 when the count remains unknown). With a
+    # variable frame rate, the frames and the duration are those of the timestamps in frame_times.
+    def probeVideo(self, video, filename):
+        rate = self.videoFps(video)
+        if self.frame_times is not None:
+            return rate, len(self.frame_times), self.frame_times[-1] + 1 / rate
+        frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        if frames <= 0:
+            frames = probeFrameCount(filename)
+        return rate, frames, frames / rate
+
+    # Returns the timestamps of the frames of a video when its frame rate varies, and None when they follow
+    # its constant frame rate to within half a frame. They are read from the packets by ffmpeg (see
+    # probeFrameTimes); without ffmpeg, OpenCV gives the timestamps of the first VFR_PROBE_FRAMES frames,
+    # and those of every frame are only read when these vary.
+    def frameTimes(self, filename):
+        video = cv2.VideoCapture(filename)
+        rate = self.videoFps(video)
+        times = probeFrameTimes(filename)
+        if times is None:
+            times = captureTimes(video, VFR_PROBE_FRAMES)
+            if (times is not None and not constantRate(times, rate)):
+                times = captureTimes(video)
+        video.release()
+        if (times is None or constantRate(times, rate)):
+            return None
+        return times
+
+    # Returns the index of the first frame after the TIME_OFFSET seconds which are skipped.
+    def offsetFrames(self, rate):
+        if self.frame_times is not None:
+            return int(np.searchsorted(self.frame_times, self.TIME_OFFSET))
+        return math.ceil(self.TIME_OFFSET * rate)
+
+    # Generator of the frame indices which will be analysed, in increasing order.
+    # "total" is the number of frames in the video; when it is unknown (0), indices are generated
+    # until the video runs out of frames.
+    # When filter is set, only the frames from each 10th second are scheduled; with a variable frame rate,
+    # those whose timestamp falls in it.
+    # Frames up to the index "after" (e.g. already written before a checkpoint) are left out.
+    def frameSchedule(self, rate, total, filter, after=-1):
+        start = max(self.offsetFrames(rate), after + 1)
+        if (total <= 0):
+            total = math.inf
+
+        if not filter:
+            index = start
+            while index < total:
+                yield index
+                index += 1
+            return
+
+        if self.frame_times is not None:
+            seconds = np.floor(self.frame_times[start:]).astype(np.int64)
+            for index in np.flatnonzero(seconds % 10 == 0) + start:
+                yield int(index)
+            return
+
+        # Walk over every 10th second, starting with the one holding the first frame after the offset.
+        second = math.floor(start / rate) // 10 * 10
+        while math.ceil(second * rate) < total:
+            first = max(math.ceil(second * rate), start)
+            last = min(math.ceil((second + 1) * rate), total)
+            index = first
+            while index < last:
+                yield index
+                index += 1
+            second += 10
+
+    # Generator which decodes only the scheduled frames of a video, yielding (index, image) pairs.
+    # Short gaps are skipped with grab(), which does not convert the skipped frames; longer gaps
+    # are reached by seeking the video. A video with a variable frame rate is not seeked, as OpenCV
+    # estimates the frame it lands on from the mean frame rate; every gap is grabbed, and going back
+    # starts over from the first frame.
+    def readFrames(self, video, indices):
+        position = int(video.get(cv2.CAP_PROP_POS_FRAMES))
+        for index in indices:
+            start = self.METRICS.clock()
+            gap = index - position
+            if (gap < 0 and self.frame_times is not None):
+                video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                self.METRICS.count("seeks")
+                gap = index
+            if ((gap > self.SEEK_THRESHOLD and self.frame_times is None) or gap < 0):
+                video.set(cv2.CAP_PROP_POS_FRAMES, index)
+                self.METRICS.count("seeks")
+            else:
+                self.METRICS.count("frames_grabbed", gap)
+                while gap > 0:
+                    video.grab()
+                    gap -= 1
 
-            # Set bounds on seconds from 0 to 59, wrapping back to 0
-            # Ex: 0:59:28...0:59:29...0:59:30...1:00:01...1:00:02...
-            if (second == 60):
-                minute += 1
-                print("{} minute(s) processed.".format(minute))
-                second = 0
+            success, image = video.read()
+            if (success == False):
+                return
+            self.METRICS.count("frames_decoded")
+            self.METRICS.timed("decode_seconds", start)
+            position = index + 1
+            yield index, image
+
+    # Sets DECODE_CROP for the ffmpeg backend, from the dosimeter boxes found in the origin frame, and moves the
+    # tracked boxes into the cropped frames. The crop is aligned to even pixels, for subsampled chroma.
+    def setDecodeCrop(self, video):
+        self.DECODE_CROP = None
+        boxes = self.TRACKER["boxes"] if self.DOSIMETERS > 1 else [self.TRACKER["box"]]
+        if (self.DECODE_BACKEND != "ffmpeg" or self.frame_times is not None or None in boxes or not boxes or not rawvideo.available()):
+            return
+
+        # The crop holds all of the dosimeters.
+        width, height = frameSize(video)
+        x0 = max(min(x for x, _, _, _ in boxes) - self.FFMPEG_CROP_MARGIN, 0) // 2 * 2
+        y0 = max(min(y for _, y, _, _ in boxes) - self.FFMPEG_CROP_MARGIN, 0) // 2 * 2
+        x1 = min(max(x + w for x, _, w, _ in boxes) + self.FFMPEG_CROP_MARGIN, width)
+        y1 = min(max(y + h for _, y, _, h in boxes) + self.FFMPEG_CROP_MARGIN, height)
+        self.DECODE_CROP = (x0, y0, (x1 - x0) // 2 * 2, (y1 - y0) // 2 * 2)
+        boxes = [(x - x0, y - y0, w, h) for x, y, w, h in boxes]
+        if self.DOSIMETERS > 1:
+            self.TRACKER["boxes"] = boxes
+        else:
+            self.TRACKER["box"] = boxes[0]
+
+    # Generator which decodes the scheduled frames of a video with ffmpeg, yielding the same (index, image)
+    # pairs as readFrames, cropped to DECODE_CROP. Each run of consecutive scheduled frames (e.g. one second
+    # of filtered data) is read by an ffmpeg process which seeks to its first frame and stops after its
+    # last one, so the frames in between runs are never decoded. When "count" is set (the number of
+    # scheduled frames, if known), runs are at most that long. The images are views over "buffers" reusable
+    # buffers (see rawvideo.py).
+    def readRawFrames(self, filename, video, indices, rate, count=0, buffers=1):
+        size = frameSize(video)
+        indices = iter(indices)
+        index = next(indices, None)
+        while index is not None:
+            # Frames are read from ffmpeg until the schedule skips a frame; the next run gets a new process.
+            reader = rawvideo.RawVideoReader(filename, size, rate, index, self.DECODE_CROP, count, buffers)
+            try:
+                while index is not None:
+                    start = self.METRICS.clock()
+                    image = next(reader, None)
+                    if image is None:
+                        return
+                    self.METRICS.count("frames_decoded")
+                    self.METRICS.timed("decode_seconds", start)
+                    yield index, image
+
+                    following = next(indices, None)
+                    if following != index + 1:
+                        index = following
+                        break
+                    index = following
+            finally:
+                reader.close()
+
+    # Returns an iterator of the scheduled (index, image) frames of a video, from the DECODE_BACKEND decoder.
+    # "count" is the number of scheduled frames, when known. Falls back to OpenCV when ffmpeg is not installed,
+    # and for a video with a variable frame rate, as ffmpeg seeks to the frame index by time.
+    def decodeFrames(self, filename, video, indices, rate, count=0):
+        if (self.DECODE_BACKEND == "ffmpeg" and self.frame_times is None and rawvideo.available()):
+            # The pipeline holds on to the frames in its queue and detection threads.
+            buffers = self.PIPELINE_QUEUE + self.PIPELINE_THREADS + 2 if self.PIPELINE_THREADS > 0 else 1
+            return self.readRawFrames(filename, video, indices, rate, count, buffers)
+        if (self.DECODE_BACKEND == "ffmpeg" and self.frame_times is None):
+            print("ffmpeg was not found; decoding with OpenCV instead.")
+        return self.readFrames(video, indices)
+
+    # Generator which crops and samples the decoded (index, image) frames of a video, yielding
+    # a [frame index, minute, second, frame, r, g, b] row for each of them, in order.
+    def analyseFrames(self, frames, rate, tracker=None, roi_writer=None):
+        # Labels and crops of the frames waiting to be sampled as a batch.
+        pending = []
+
+        for index, image in frames:
+            minute, second, count = frameLabel(index, rate, self.frame_times)
+
+            frame = os.path.join(self.resultsDir(), "frame_%d_%d_%d.jpg" % (minute, second, count))
+            if self.DEBUG_FRAMES:
+                self.writeDebugImage(frame, image)
+
+            # Crops are copied so the batch does not keep the full frames alive.
+            ROI = self.processFrames(image, frame, tracker)
+            pending.append(([index, minute, second, count], copyRegions(ROI)))
+
+            if len(pending) >= self.SAMPLE_BATCH:
+                yield from self.sampleRows(pending, roi_writer)
+                pending = []
+
+        yield from self.sampleRows(pending, roi_writer)
+
+    # Generator which samples the cached regions of a video (see roicache.loadEntry) instead of decoding
+    # it, yielding the same rows as analyseFrames for the frames after the index "after".
+    def cachedRows(self, entry, rate, after=-1):
+        frames = entry["frames"]
+        start = int(np.searchsorted(frames, after, side="right"))
+        for first in range(start, len(frames), self.SAMPLE_BATCH):
+            last = min(first + self.SAMPLE_BATCH, len(frames))
+
+            # Regions in which the dosimeter was not found have a (0, 0) size and are sampled as -1.
+            start = self.METRICS.clock()
+            samples = sampleBatch(np.asarray(entry["rois"][first : last]), self.testing, self.SAMPLE_PATCH, np.asarray(entry["sizes"][first : last]))
+            self.METRICS.count("frames_sampled", last - first)
+            self.METRICS.timed("sample_seconds", start)
+            for i in range(first, last):
+                index = int(frames[i])
+                r, g, b = samples[i - first]
+                yield [index, *frameLabel(index, rate, self.frame_times), int(r), int(g), int(b)]
+
+    # Generator which analyses the decoded (index, image) frames of a video with a staged pipeline and yields
+    # the same rows as analyseFrames, in order. A decoder thread feeds a bounded queue of frames to
+    # "threads" detection/sampling threads (OpenCV releases the GIL), whose rows are put back in frame
+    # order here. The bounded queues cap the number of frames held in memory.
+    # A full frames queue means detection is the bottleneck; a full results queue means writing is.
+    # The first error of any stage, or the consumer closing the generator early, sets "stop", which every stage
+    # checks while waiting on a queue, so the threads finish and the error is raised here instead of hanging.
+    def analysePipeline(self, frames, rate, threads, tracker=None, roi_writer=None):
+        decoded = frames
+        frames = queue.Queue(self.PIPELINE_QUEUE)
+        results = queue.Queue(self.PIPELINE_QUEUE)
+        frame_stats = newQueueStats("Frames")
+        result_stats = newQueueStats("Results")
+        errors = []
+        stop = threading.Event()
+
+        def fail(e):
+            errors.append(e)
+            stop.set()
+
+        def decode():
+            try:
+                for seq, (index, image) in enumerate(decoded):
+                    if not queuePut(frames, frame_stats, (seq, index, image), stop):
+                        break
+            except Exception as e:
+                fail(e)
+            finally:
+                # Releases the decoder (e.g. stops ffmpeg) when the pipeline stopped before the last frame.
+                if hasattr(decoded, "close"):
+                    decoded.close()
+            for _ in range(threads):
+                queuePut(frames, frame_stats, None, stop)
+
+        def detect():
+            try:
+                while True:
+                    item = queueGet(frames, frame_stats, stop)
+                    if item is None:
+                        break
+                    seq, index, image = item
+                    minute, second, count = frameLabel(index, rate, self.frame_times)
+
+                    frame = os.path.join(self.resultsDir(), "frame_%d_%d_%d.jpg" % (minute, second, count))
+                    if self.DEBUG_FRAMES:
+                        self.writeDebugImage(frame, image)
+
+                    ROI = self.processFrames(image, frame, tracker)
+                    row = self.sampleRows([([index, minute, second, count], ROI)])[0]
+                    if roi_writer is not None and ROI is not None:
+                        ROI = ROI.copy()
+                    if not queuePut(results, result_stats, (seq, row, ROI), stop):
+                        break
+            except Exception as e:
+                fail(e)
+            queuePut(results, result_stats, None, stop)
+
+        workers = [threading.Thread(target=decode, daemon=True)]
+        workers += [threading.Thread(target=detect, daemon=True) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+
+        # Rows which arrived before the rows preceding them.
+        waiting = {}
+        next_seq = 0
+        running = threads
+        try:
+            while running > 0:
+                item = queueGet(results, result_stats, stop)
+                if stop.is_set():
+                    break
+                if item is None:
+                    running -= 1
+                    continue
+
+                seq, row, ROI = item
+                waiting[seq] = (row, ROI)
+                while next_seq in waiting:
+                    row, ROI = waiting.pop(next_seq)
+                    if roi_writer is not None:
+                        roi_writer.write(row[0], ROI)
+                    yield row
+                    next_seq += 1
+        finally:
+            # Also reached when the consumer stops early (GeneratorExit, or an error while writing a row).
+            stop.set()
+            for worker in workers:
+                worker.join()
+        if errors:
+            raise errors[0]
+
+        printQueueStats(frame_stats)
+        printQueueStats(result_stats)
+
+    # Analyses the decoded (index, image) frames of a video, with the threaded pipeline when
+    # PIPELINE_THREADS is set and serially otherwise.
+    def frameRows(self, frames, rate, tracker=None, roi_writer=None):
+        if self.PIPELINE_THREADS > 0:
+            return self.analysePipeline(frames, rate, self.PIPELINE_THREADS, tracker, roi_writer)
+        return self.analyseFrames(frames, rate, tracker, roi_writer)
+
+    # Returns whether the testing colour of any dosimeter changed by more than ADAPTIVE_THRESHOLD between two
+    # rows; a frame in which a dosimeter was found next to one in which it was not also counts as a change.
+    def colourChanged(self, row, other):
+        for i in range(4, len(row), 3):
+            if (row[i] < 0) != (other[i] < 0):
+                return True
+            if max(abs(a - b) for a, b in zip(row[i : i + 3], other[i : i + 3])) > self.ADAPTIVE_THRESHOLD:
+                return True
+        return False
 
-            # Skip the first thirty seconds of video.
-            if (framecount < frame_offset):
-                framecount += 1
-                count += 1
+    # Reads the frames at "positions" in the scheduled frame "indices"; returns their rows by position.
+    # Frames past the end of the video are left out.
+    def readPositions(self, filename, video, rate, indices, positions):
+        if not positions:
+            return {}
+        frames = self.decodeFrames(filename, video, [indices[p] for p in positions], rate, len(positions))
+        return {position: row for row, position in zip(self.frameRows(frames, rate), positions)}
+
+    # Generator of the rows of adaptive sampling (see ADAPTIVE) over the scheduled frame "indices", in frame
+    # order, leaving out the frames up to the index "after". The frames every ADAPTIVE_STEP seconds are read
+    # in turn, and the gap between each of them and the previous one is finished before moving on: each round
+    # reads the middle frame of every part of the gap whose ends changed colour, until no part needs to be
+    # split. The rows of a gap are yielded once it is finished, so they are written, and checkpointed, as the
+    # video is read. A gap only depends on the readings at its ends, so the readings depend only on the video
+    # and the settings; a resumed run reads the same frames, and skips the gaps before "after".
+    def adaptiveRows(self, filename, video, rate, indices, after=-1):
+        step = max(round(self.ADAPTIVE_STEP * rate), 1)
+        coarse = sorted(set(range(0, len(indices), step)) | {len(indices) - 1}) if indices else []
+        read = 0
+
+        # Rows of the current gap by position in "indices", starting with the reading at its first end.
+        rows = {}
+        for first, last in zip([None] + coarse, coarse):
+            if indices[last] <= after:
+                rows = {}
                 continue
-
-            frame = ("frame_%d_%d_%d.jpg" % (minute, second, count))
-            if filter:
-                if second % 10 == 0:
-                    cv2.imwrite(frame, image)
-                    framecount += 1
-
-                    if (processFrames(frame, True) == False):
-                        file_writer.writerow([minute, second, count, -1, -1, -1])
-                        continue
-
-                    r, g, b = sampleColor(frame,testing)
-                    file_writer.writerow([minute, second, count, r, g, b])
-                    
+            for position in (first, last):
+                if position is not None and position not in rows:
+                    found = self.readPositions(filename, video, rate, indices, [position])
+                    read += len(found)
+                    rows.update(found)
+            # The video ended before the end of the gap.
+            if last not in rows:
+                break
+
+            parts = [(first, last)] if first in rows else []
+            while parts:
+                splits = [(a, (a + b) // 2, b) for a, b in parts if b - a > 1 and self.colourChanged(rows[a], rows[b])]
+                found = self.readPositions(filename, video, rate, indices, [middle for _, middle, _ in splits])
+                read += len(found)
+                rows.update(found)
+                parts = [part for a, middle, b in splits if middle in found for part in ((a, middle), (middle, b))]
+
+            for position in sorted(rows):
+                if position != last and rows[position][0] > after:
+                    yield rows[position]
+            rows = {last: rows[last]}
+
+        for row in rows.values():
+            if row[0] > after:
+                yield row
+        print("Adaptive sampling read {} of {} scheduled frames.".format(read, len(indices)))
+
+    # Splits the scheduled frames into contiguous segments, analyses them in a pool of "workers"
+    # processes and yields the rows of each segment in frame order.
+    def analyseParallel(self, filename, rate, indices, workers):
+        count = max(min(workers * SEGMENTS_PER_WORKER, len(indices)), 1)
+        size = math.ceil(len(indices) / count)
+        tasks = [(filename, rate, indices[i : i + size]) for i in range(0, len(indices), size)]
+
+        with multiprocessing.Pool(workers, initializer=initWorker, initargs=(self,)) as pool:
+            for done, (rows, frames, fallbacks, snapshot) in enumerate(pool.imap(analyseSegment, tasks), 1):
+                self.TRACKER["frames"] += frames
+                self.TRACKER["fallbacks"] += fallbacks
+                if snapshot is not None:
+                    self.METRICS.merge(snapshot)
+                print("{} of {} segments processed.".format(done, len(tasks)))
+                yield from rows
+
+    # Function to extract frames
+    # "filename" is a string that contains the name of the video file to be processed
+    # "filter" is a boolean that denotes whether to filter frames or not
+    # When filter = 1, only the frames from each 10th second are captured (Ex 30 frames @ 0, 10, 20 30, etc.)
+    # When filter = 0, all frames are captured
+    # Only the scheduled frames are decoded; the minute/second/frame labels use the video's own frame rate,
+    # or the timestamps of its frames when it varies (see frameTimes).
+    # With ADAPTIVE, only some of the scheduled frames are read (see adaptiveRows), in a single process.
+    # When "workers" (WORKERS by default) is above 1 and the frame count of the video is known, the
+    # frames are analysed in that many processes; the rows are written in the same order.
+    # With a "cached" ROI cache entry, the cached regions are sampled instead of decoding the video. Otherwise,
+    # when ROI_CACHE_DIR is set, the regions of a complete serial run are added to the cache.
+    # With INSTRUMENT, the throughput and time left are printed as the frames are analysed, and the
+    # metrics of the run are written next to the results.
+    def getTheFrames(self, filename, filter, workers=None, checkpoint=None, cached=None):
+        if workers is None:
+            workers = self.WORKERS
+        after = -1
+        if checkpoint is not None:
+            after = checkpoint["last_frame"]
+
+        # Path to video file
+        video = cv2.VideoCapture(filename)
+        rate, total, _ = self.probeVideo(video, filename)
+        if checkpoint is None:
+            self.setDecodeCrop(video)
+
+        # Used as counter variables
+        framecount = 0 if checkpoint is None else checkpoint["rows"]
+        first_count = framecount
+        last_frame = after
+        last_minute = 0
+
+        # Create a local directory storing all of the frames for a given test.
+        os.makedirs(self.resultsDir(), exist_ok=True)
+
+        roi_writer = None
+
+        # The time left is estimated from the number of frames scheduled, when the frame count is known.
+        # Adaptive sampling goes back and forth, which a video with a variable frame rate does not seek.
+        adaptive = self.ADAPTIVE and total > 0 and self.frame_times is None
+        if (self.ADAPTIVE and total <= 0):
+            print("The frame count of {} is unknown; reading every scheduled frame instead of adaptive sampling.".format(filename))
+        elif (self.ADAPTIVE and not adaptive):
+            print("{} has a variable frame rate; reading every scheduled frame instead of adaptive sampling.".format(filename))
+        if self.INSTRUMENT:
+            expected = sum(1 for _ in self.frameSchedule(rate, total, filter, after)) if total > 0 and not adaptive else 0
+            self.METRICS = metrics.Metrics(expected, self.METRICS_INTERVAL)
+
+        # Open a result sink for each of the output formats.
+        result_sinks = sinks.openSinks(self.RESULT_FORMATS, os.path.join(self.resultsDir(), self.vid_name), self.base_rgb, rate,
+            None if checkpoint is None else checkpoint["sinks"], interval=self.AGGREGATE_SECONDS, times=self.frame_times)
+        try:
+            # Keep the position locked in by initDosSize, but count the fallbacks for this run only.
+            self.TRACKER["frames"] = 0
+            self.TRACKER["fallbacks"] = 0
+
+            if cached is not None:
+                video.release()
+                rows = self.cachedRows(cached, rate, after)
+            elif adaptive:
+                rows = self.adaptiveRows(filename, video, rate, list(self.frameSchedule(rate, total, filter)), after)
+            elif (workers > 1 and total > 0 and self.frame_times is None):
+                video.release()
+                rows = self.analyseParallel(filename, rate, list(self.frameSchedule(rate, total, filter, after)), workers)
             else:
-                cv2.imwrite(frame, image)
+                if (self.ROI_CACHE_DIR != "" and checkpoint is None and self.DOSIMETERS == 1):
+                    roi_writer = roicache.CacheWriter(self.ROI_CACHE_DIR, self.cacheKey(filename, filter), (self.DOS_MAX_SIZE, self.DOS_MAX_SIZE),
+                        self.ORIGIN_ROI, {"size": [self.DOS_MIN_SIZE, self.DOS_MAX_SIZE, self.DOS_WIDTH, self.DOS_HEIGHT]})
+                frames = self.decodeFrames(filename, video, self.frameSchedule(rate, total, filter, after), rate)
+                rows = self.frameRows(frames, rate, None, roi_writer)
+
+            for row in rows:
+                # Ex: 0:59:28...0:59:29...0:59:30...1:00:01...1:00:02...
+                if (workers <= 1 and row[1] > last_minute):
+                    last_minute = row[1]
+                    print("{} minute(s) processed.".format(last_minute))
+
+                start = self.METRICS.clock()
+                for sink in result_sinks:
+                    sink.write(row)
+                self.METRICS.count("rows_written")
+                self.METRICS.timed("write_seconds", start)
                 framecount += 1
+                last_frame = row[0]
+                self.METRICS.progress(framecount - first_count)
+
+                if (self.CHECKPOINT_FRAMES > 0 and framecount % self.CHECKPOINT_FRAMES == 0):
+                    self.saveCheckpoint(filename, filter, last_frame, framecount, result_sinks, False)
+
+            if self.CHECKPOINT_FRAMES > 0:
+                self.saveCheckpoint(filename, filter, last_frame, framecount, result_sinks, True)
+
+            if roi_writer is not None:
+                roi_writer.close()
+                roi_writer = None
+                roicache.evict(self.ROI_CACHE_DIR, self.ROI_CACHE_BUDGET, self.cacheKey(filename, filter))
+        finally:
+            for sink in result_sinks:
+                sink.close()
+            if roi_writer is not None:
+                roi_writer.close(complete=False)
+
+        video.release()
+
+        if self.TRACKING:
+            print("Tracking fell back to a full-frame search on {} of {} frames.".format(self.TRACKER["fallbacks"], self.TRACKER["frames"]))
+
+        if self.INSTRUMENT:
+            self.METRICS.writeReport(os.path.join(self.resultsDir(), self.vid_name), {"video": self.vid_name})
+
+        return framecount
+
+    # Returns the key of the ROI cache entry of a video: a hash of the video and of the settings which
+    # change the cropped regions. The sampling settings are left out, so they can change between runs.
+    def cacheKey(self, filename, filter):
+        names = ["TIME_OFFSET", "R_LOWER", "R_UPPER", "G_LOWER", "G_UPPER", "B_LOWER", "B_UPPER", "NUM_SAMPLES",
+            "X_OFF", "Y_OFF", "TOLERANCE", "DEFAULT_SIZE", "DETECT_SCALE", "DETECT_MIN_PIXELS", "TRACKING", "DECODE_BACKEND",
+            "FFMPEG_CROP_MARGIN"]
+        settings = [videoFingerprint(filename), bool(filter)] + [getattr(self, name) for name in names]
+        return hashlib.sha1(json.dumps(settings).encode()).hexdigest()
+
+    # Restores the locked dosimeter size and the origin frame from a ROI cache entry.
+    def restoreCached(self, entry):
+        self.DOS_SIZE_SET = True
+        self.DOS_MIN_SIZE, self.DOS_MAX_SIZE, self.DOS_WIDTH, self.DOS_HEIGHT = entry["meta"]["values"]["size"]
+        self.ORIGIN_ROI = entry["origin"]
+
+    # Returns the settings which change the results of a run; a checkpoint may only be resumed with the same settings.
+    def runParameters(self, filter):
+        names = ["TIME_OFFSET", "R_LOWER", "R_UPPER", "G_LOWER", "G_UPPER", "B_LOWER", "B_UPPER", "NUM_SAMPLES",
+            "X_OFF", "Y_OFF", "TOLERANCE", "inner_ratio", "outer_ratio", "SAMPLE_PATCH", "DETECT_SCALE",
+            "DETECT_MIN_PIXELS", "TRACKING", "RESULT_FORMATS", "DECODE_BACKEND", "FFMPEG_CROP_MARGIN", "ADAPTIVE", "ADAPTIVE_STEP",
+            "ADAPTIVE_THRESHOLD", "DOSIMETERS", "AGGREGATE_SECONDS"]
+        parameters = {name: getattr(self, name) for name in names}
+        parameters["filter"] = bool(filter)
+        return parameters
+
+    def checkpointFile(self):
+        return os.path.join(self.resultsDir(), self.vid_name + ".checkpoint.json")
+
+    # Writes a checkpoint next to the results, after the sinks have written out every row up to the
+    # frame "last_frame". It holds everything needed to continue the run: the locked dosimeter size,
+    # the sample points, the baseline values and the position of each sink.
+    def saveCheckpoint(self, filename, filter, last_frame, rows, result_sinks, complete):
+        checkpoint = {
+            "video": videoFingerprint(filename),
+            "parameters": self.runParameters(filter),
+            "last_frame": last_frame,
+            "rows": rows,
+            "complete": complete,
+            "size": [self.DOS_MIN_SIZE, self.DOS_MAX_SIZE, self.DOS_WIDTH, self.DOS_HEIGHT],
+            "testing": self.testing,
+            "baseline": self.baseline,
+            "base_rgb": self.base_rgb,
+            "tracked_box": self.TRACKER["box"],
+            "crop": self.DECODE_CROP,
+            "dosimeters": [{"size": [dosimeter.DOS_MIN_SIZE, dosimeter.DOS_MAX_SIZE, dosimeter.DOS_WIDTH, dosimeter.DOS_HEIGHT],
+                "testing": dosimeter.testing, "baseline": dosimeter.baseline, "base_rgb": dosimeter.base_rgb}
+                for dosimeter in self.dosimeters],
+            "tracked_boxes": self.TRACKER["boxes"],
+            "sinks": {name: sink.checkpoint() for name, sink in zip(self.RESULT_FORMATS, result_sinks)},
+        }
+        # The checkpoint reaches the disk before it replaces the previous one, after the outputs it points into.
+        temporary = self.checkpointFile() + ".tmp"
+        with open(temporary, "w") as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temporary, self.checkpointFile())
+
+    # Loads the checkpoint of the current video; returns None when there is none.
+    # An error is raised when the video or the settings have changed since the checkpoint was written, or when
+    # an output is shorter than the checkpoint records (e.g. its last rows were lost in a power cut).
+    def loadCheckpoint(self, filename, filter):
+        if not path.exists(self.checkpointFile()):
+            return None
+        with open(self.checkpointFile()) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+
+        if checkpoint["video"] != videoFingerprint(filename):
+            raise ValueError("the video has changed since the checkpoint was written")
+        if checkpoint["parameters"] != json.loads(json.dumps(self.runParameters(filter))):
+            raise ValueError("the settings have changed since the checkpoint was written")
+        if not checkpoint["complete"]:
+            sinks.checkResume(self.RESULT_FORMATS, os.path.join(self.resultsDir(), self.vid_name), checkpoint["sinks"], self.DOSIMETERS)
+        return checkpoint
+
+    # Restores the dosimeter size, sample points and baseline values locked in before a checkpoint.
+    def restoreCheckpoint(self, checkpoint):
+        self.DOS_SIZE_SET = True
+        self.DOS_MIN_SIZE, self.DOS_MAX_SIZE, self.DOS_WIDTH, self.DOS_HEIGHT = checkpoint["size"]
+        self.testing.extend(tuple(point) for point in checkpoint["testing"])
+        self.baseline.extend(tuple(point) for point in checkpoint["baseline"])
+        self.base_rgb.extend(checkpoint["base_rgb"])
+        if checkpoint["tracked_box"] is not None:
+            self.TRACKER["box"] = tuple(checkpoint["tracked_box"])
+        if checkpoint.get("crop") is not None:
+            self.DECODE_CROP = tuple(checkpoint["crop"])
+        for dosimeter, state in zip(self.dosimeters, checkpoint.get("dosimeters", [])):
+            dosimeter.DOS_SIZE_SET = True
+            dosimeter.DOS_MIN_SIZE, dosimeter.DOS_MAX_SIZE, dosimeter.DOS_WIDTH, dosimeter.DOS_HEIGHT = state["size"]
+            dosimeter.testing = [tuple(point) for point in state["testing"]]
+            dosimeter.baseline = [tuple(point) for point in state["baseline"]]
+            dosimeter.base_rgb = list(state["base_rgb"])
+        self.TRACKER["boxes"] = [tuple(box) for box in checkpoint.get("tracked_boxes", [])]
+
+    # Places the sample points for the dosimeter cropped from the origin frame, "ROI", and samples the baseline values from it.
+    # With several DOSIMETERS, "ROI" holds a region per dosimeter, and base_rgb the baseline values of each in turn.
+    def setOrigin(self, ROI):
+        self.ORIGIN_ROI = ROI
+        if self.DOSIMETERS > 1:
+            self.base_rgb = []
+            for i, (dosimeter, region) in enumerate(zip(self.dosimeters, ROI)):
+                print("Dosimeter {}:".format(i + 1))
+                dosimeter.setOrigin(region)
+                self.base_rgb += dosimeter.base_rgb
+            return
+        self.initSamples()
+        self.base_rgb = list(self.sampleColor(self.ORIGIN_ROI, self.baseline, self.SAMPLE_PATCH))
+
+    # Analyses a single BGR frame, e.g. one handed over by a caller which decodes the frames itself, and returns
+    # its [r, g, b] testing values, or None when the dosimeter was not found. The first frame in which the
+    # dosimeter is found locks its size and becomes the origin frame of the baseline values. Several threads may
+    # call analyzeFrame at once; each should pass its own "tracker" (see newTracker) in tracking mode.
+    # With several DOSIMETERS, a list of the values of each dosimeter (None for those not found) is returned.
+    def analyzeFrame(self, frame, name="", tracker=None):
+        ROI = self.processFrames(frame, name, tracker)
+        if ROI is None:
+            return None
+        with self.lock:
+            if self.ORIGIN_ROI is None:
+                self.setOrigin(copyRegions(ROI))
+        if self.DOSIMETERS > 1:
+            return [None if region is None else dosimeter.sampleColor(region, dosimeter.testing, self.SAMPLE_PATCH)
+                for dosimeter, region in zip(self.dosimeters, ROI)]
+        return self.sampleColor(ROI, self.testing, self.SAMPLE_PATCH)
+
+    # Calibrates the colour and size thresholds on CALIBRATION_FRAMES frames spread between the offset and the
+    # end of a video (see calibration.py), and uses them from then on. They are also saved to CALIBRATION_FILE,
+    # when it is set. Returns whether thresholds which find the dosimeter were found.
+    def calibrate(self, filename):
+        video = cv2.VideoCapture(filename)
+        rate, total, _ = self.probeVideo(video, filename)
+        first = self.offsetFrames(rate)
+        # Without a frame count, frames 10 seconds apart are sampled.
+        last = total - 1 if total > 0 else first + (self.CALIBRATION_FRAMES - 1) * math.ceil(rate * 10)
+        indices = sorted(set(np.linspace(first, max(last, first), self.CALIBRATION_FRAMES).astype(int).tolist()))
+
+        candidates = [calibration.frameCandidates(image, self.X_OFF, self.Y_OFF, self.NUM_SAMPLES)
+            for _, image in self.readFrames(video, indices)]
+        video.release()
+
+        parameters, frames, sampled = calibration.chooseParameters(candidates, self.NUM_SAMPLES)
+        if parameters is None:
+            print("Calibration did not find the dosimeter in any of the {} frames sampled.".format(sampled))
+            return False
+        print("Calibrated on {} of {} frames sampled: {}".format(frames, sampled, parameters))
+        if self.CALIBRATION_FILE != "":
+            calibration.saveParameters(self.CALIBRATION_FILE, parameters, self.vid_name, frames, sampled)
+        for name, value in parameters.items():
+            setattr(self, name, value)
+        self.DEFAULT_SIZE = tuple(self.DEFAULT_SIZE)
+        return True
 
-                if (processFrames(frame, True) == False):
-                        file_writer.writerow([minute, second, count, -1, -1, -1])
-                        continue
+    # Resets the per-video state, so several videos can be analysed one after the other by the same Analyzer:
+    #   vid_name:         name the results are named after: "name" when given (see resultNames), and the name
+    #                     of the video without its extension otherwise.
+    #   DOS_SIZE_SET:     whether the dosimeter size has been locked from the origin frame; until then, the
+    #                     DOS_MIN_SIZE and DOS_MAX_SIZE size limits are those of DEFAULT_SIZE.
+    #   DOS_WIDTH/HEIGHT: size of the dosimeter in the origin frame.
+    #   ORIGIN_ROI:       cropped dosimeter region of the origin frame, used to sample the baseline values.
+    #   testing:          (x, y) points sampled in the center circle of the dosimeter for testing UV exposure levels.
+    #   baseline:         (x, y) points sampled in the outer ring, for the baseline values in base_rgb.
+    #   TRACKER:          tracking state used by default (see newTracker).
+    #   DECODE_CROP:      (x, y, w, h) region the ffmpeg backend crops the frames to (see setDecodeCrop).
+    #   METRICS:          instrumentation of the current run (see metrics.py).
+    #   dosimeters:       with several DOSIMETERS, an Analyzer holding the state above for each dosimeter; the
+    #                     size limits of this one then fit all of them.
+    def resetVideo(self, filename, name=None):
+        self.vid_name = name if name is not None else path.splitext(path.basename(filename))[0]
+        self.DOS_SIZE_SET = False
+        self.DOS_MIN_SIZE, self.DOS_MAX_SIZE = self.DEFAULT_SIZE
+        self.DOS_WIDTH = 0
+        self.DOS_HEIGHT = 0
+        self.ORIGIN_ROI = None
+        self.DECODE_CROP = None
+        self.METRICS = metrics.NullMetrics()
+        self.TRACKER = newTracker()
+        self.testing = []
+        self.baseline = []
+        self.base_rgb = []
+        self.dosimeters = [self.newDosimeter() for _ in range(self.DOSIMETERS)] if self.DOSIMETERS > 1 else []
+
+    # Returns an Analyzer with the same settings, which holds the state of one of several dosimeters.
+    def newDosimeter(self):
+        dosimeter = copy.copy(self)
+        dosimeter.DOSIMETERS = 1
+        dosimeter.resetVideo("")
+        dosimeter.vid_name = self.vid_name
+        return dosimeter
+
+    # Analyses a single video and writes its results into OUTPUT_DIR.
+    # With "resume", a run interrupted after a checkpoint continues from its last written frame.
+    # Returns a summary with the number of frames analysed, the elapsed time and the status of the run.
+    # "name" optionally overrides the name the results are written under (see resetVideo).
+    # An Analyzer analyses one video at a time; another call waits for the running one to finish.
+    def analyzeVideo(self, filename, filter, workers=None, resume=False, name=None):
+        with self.running:
+            start = time.perf_counter()
+            self.resetVideo(filename, name)
+            summary = {"video": filename, "frames": 0, "seconds": 0.0, "status": "ok"}
+            self.frame_times = self.frameTimes(filename)
+            if self.frame_times is not None:
+                print("{} has a variable frame rate; labelling its frames with their timestamps, and reading them in turn "
+                    "with OpenCV in a single process.".format(filename))
+
+            checkpoint = None
+            if resume:
+                try:
+                    checkpoint = self.loadCheckpoint(filename, filter)
+                except ValueError as e:
+                    print("Unable to resume {}: {}.".format(filename, e))
+                    summary["status"] = "cannot resume: {}".format(e)
+                    return summary
+
+            # Regions cached by an earlier run of the same video with the same detection settings.
+            cached = None
+            if (self.ROI_CACHE_DIR != "" and not self.ADAPTIVE and self.DOSIMETERS == 1):
+                cached = roicache.loadEntry(self.ROI_CACHE_DIR, self.cacheKey(filename, filter))
+
+            if checkpoint is not None:
+                if checkpoint["complete"]:
+                    print("{} has already been processed.".format(filename))
+                    summary["frames"] = checkpoint["rows"]
+                    return summary
+                print("Resuming {} after frame {}.".format(filename, checkpoint["last_frame"]))
+                self.restoreCheckpoint(checkpoint)
+                summary["frames"] = self.getTheFrames(filename, filter, workers, checkpoint, cached)
+                summary["seconds"] = time.perf_counter() - start
+                return summary
+
+            # Initialize the dosimeter size for the given video, unless it is known from the cached regions.
+            if cached is not None:
+                print("Sampling the cached regions of {}.".format(filename))
+                self.restoreCached(cached)
+            else:
+                found = self.initDosSize(filename)
+                if (found == False and self.AUTO_CALIBRATE):
+                    print("Calibrating the rgb and size thresholds on {}...".format(filename))
+                    if self.calibrate(filename):
+                        self.resetVideo(filename, self.vid_name)
+                        found = self.initDosSize(filename)
+                if (found == False):
+                    print("Was unable to determine dosimeter from {}. Please modify the rgb or size thresholds based on the origin image, or run with --calibrate".format(filename))
+                    summary["status"] = "dosimeter not found"
+                    return summary
+
+            # Initialize the sample points based off the size of the dosimeter, and calculate the baseline
+            # rgb values for the origin frame.
+            self.setOrigin(self.ORIGIN_ROI)
+            print(self.base_rgb)
+
+            summary["frames"] = self.getTheFrames(filename, filter, workers, None, cached)
+            summary["seconds"] = time.perf_counter() - start
+            return summary
+
+    # Capture thread of the live mode. Reads every frame of the source and keeps only the newest one in
+    # "latest", so analysis never works through a backlog when it falls behind; replaced frames are counted
+    # as dropped. With "realtime", frames are read no faster than "rate", so a file replays like a camera.
+    def captureLatest(self, video, latest, condition, rate, realtime):
+        start = time.perf_counter()
+        index = 0
+        while not latest["stop"]:
+            if realtime:
+                delay = start + index / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
 
-                r, g, b = sampleColor(frame,testing)
-                file_writer.writerow([minute, second, count, r, g, b])
+            success, image = video.read()
+            captured = time.perf_counter()
+            with condition:
+                if (success == False):
+                    latest["ended"] = True
+                    condition.notify_all()
+                    return
+                if latest["image"] is not None:
+                    latest["dropped"] += 1
+                    self.METRICS.count("frames_dropped")
+                latest.update(image=image, index=index, time=captured)
+                condition.notify_all()
+            index += 1
+
+    # Analyses a live source until it ends, "duration" seconds have passed (0 runs until interrupted with
+    # Ctrl+C) or the run is interrupted. The dosimeter size, sample points and baseline are set from the
+    # first frame in which the dosimeter is found; after that, the newest frame is analysed LIVE_RATE
+    # times per second and its reading is printed and written to the result sinks straight away.
+    # "realtime" paces the source to its own frame rate, to replay a recording as a stand-in camera.
+    # Returns a summary like analyzeVideo's, which also holds the frames dropped and the readings which
+    # took longer than LIVE_LATENCY.
+    def analyzeLive(self, source, realtime=False, duration=0):
+        with self.running:
+            start = time.perf_counter()
+            self.resetVideo(sourceName(source))
+            summary = {"video": str(source), "frames": 0, "seconds": 0.0, "status": "ok", "dropped": 0, "late": 0}
+
+            video = openSource(source)
+            if not video.isOpened():
+                print("ERROR: Unable to open {}".format(source))
+                summary["status"] = "cannot open source"
+                return summary
+            rate = self.videoFps(video)
+            if self.INSTRUMENT:
+                self.METRICS = metrics.Metrics(0, self.METRICS_INTERVAL)
+
+            latest = {"image": None, "index": -1, "time": 0.0, "dropped": 0, "ended": False, "stop": False}
+            condition = threading.Condition()
+            reader = threading.Thread(target=self.captureLatest, args=(video, latest, condition, rate, realtime), daemon=True)
+            reader.start()
+
+            os.makedirs(self.resultsDir(), exist_ok=True)
+            result_sinks = None
+            period = 1 / self.LIVE_RATE
+            due = time.perf_counter()
+            try:
+                while (duration <= 0 or time.perf_counter() - start < duration):
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                    # Take the newest frame, waiting for one when the last one has already been analysed.
+                    with condition:
+                        while latest["image"] is None and not latest["ended"]:
+                            condition.wait()
+                        if latest["image"] is None:
+                            break
+                        image, index, captured = latest["image"], latest["index"], latest["time"]
+                        latest["image"] = None
+
+                    # Readings missed while falling behind are skipped rather than made up in a burst.
+                    due = max(due + period, time.perf_counter())
+
+                    minute, second, count = frameLabel(index, rate)
+                    ROI = self.processFrames(image, "live frame %d:%d:%d" % (minute, second, count))
+                    if result_sinks is None:
+                        if ROI is None:
+                            continue
+                        self.setOrigin(copyRegions(ROI))
+                        print(self.base_rgb)
+                        result_sinks = sinks.openSinks(self.RESULT_FORMATS, os.path.join(self.resultsDir(), self.vid_name), self.base_rgb, rate, chunk_size=1,
+                            interval=self.AGGREGATE_SECONDS)
+
+                    row = self.sampleRows([([index, minute, second, count], ROI)])[0]
+                    for sink in result_sinks:
+                        sink.write(row)
+                    latency = time.perf_counter() - captured
+                    summary["frames"] += 1
+                    self.METRICS.count("rows_written")
+                    self.METRICS.observe("latency_seconds", latency)
+                    self.METRICS.progress(summary["frames"])
+
+                    late = ""
+                    if latency > self.LIVE_LATENCY:
+                        summary["late"] += 1
+                        self.METRICS.count("late_readings")
+                        late = ", over the {:.0f} ms budget".format(self.LIVE_LATENCY * 1000)
+                    readings = ", ".join("R {} G {} B {}".format(*row[i : i + 3]) for i in range(4, len(row), 3))
+                    print("{}:{:02d}:{} {} ({:.0f} ms{})".format(minute, second, count, readings, latency * 1000, late))
+            except KeyboardInterrupt:
+                print("Live capture stopped.")
+            finally:
+                latest["stop"] = True
+                reader.join(1)
+                for sink in result_sinks or []:
+                    sink.close()
+                # The capture is only released once the reader is done with it.
+                if not reader.is_alive():
+                    video.release()
+
+            summary["dropped"] = latest["dropped"]
+            summary["seconds"] = time.perf_counter() - start
+            if result_sinks is None:
+                summary["status"] = "dosimeter not found"
+            if self.INSTRUMENT:
+                self.METRICS.writeReport(os.path.join(self.resultsDir(), self.vid_name), {"video": self.vid_name})
+            print("{} readings, {} frames dropped, {} readings over the latency budget.".format(
+                summary["frames"], summary["dropped"], summary["late"]))
+            return summary
+
+# Analyzer of a worker process of analyseParallel.
+WORKER = None
+
+# Process pool initializer; installs a copy of the parent's Analyzer, with its locked dosimeter size,
+# sample points and tracked position, in the worker.
+def initWorker(analyzer):
+    global WORKER
+    WORKER = analyzer
+
+# Process pool task which analyses one contiguous segment of the scheduled frames.
+# Each worker opens its own capture and seeks to the start of its segment. Returns the rows of
+# the segment, the tracking statistics and, with INSTRUMENT, the metrics of the segment.
+def analyseSegment(task):
+    filename, rate, indices = task
+    tracker = newTracker()
+    tracker["box"] = WORKER.TRACKER["box"]
+    tracker["boxes"] = list(WORKER.TRACKER["boxes"])
+    if WORKER.INSTRUMENT:
+        WORKER.METRICS = metrics.Metrics()
 
+    video = cv2.VideoCapture(filename)
+    rows = list(WORKER.frameRows(WORKER.decodeFrames(filename, video, indices, rate, len(indices)), rate, tracker))
+    video.release()
+    return rows, tracker["frames"], tracker["fallbacks"], WORKER.METRICS.snapshot() if WORKER.INSTRUMENT else None
+
+# Batch process entry point; analyses a video with the command line settings.
+# "settings" maps the names of settings (e.g. TIME_OFFSET) to their values (see Analyzer).
+def batchTask(task):
+    filename, name, filter, workers, resume, settings = task
+    try:
+        return Analyzer(**settings).analyzeVideo(filename, filter, workers, resume, name)
+    except Exception as e:
+        return {"video": filename, "frames": 0, "seconds": 0.0, "status": "error: {}".format(e)}
+
+# Expands the command line arguments (files, directories or glob patterns) into a sorted list of videos.
+# A video given more than once (e.g. through its directory and a glob) is only listed the first time.
+def findVideos(arguments):
+    videos = []
+    for argument in arguments:
+        if path.isdir(argument):
+            for name in sorted(os.listdir(argument)):
+                if path.splitext(name)[1].lower() in VIDEO_EXTENSIONS:
+                    videos.append(path.join(argument, name))
+        elif path.exists(argument):
+            videos.append(argument)
+        else:
+            videos.extend(sorted(glob.glob(argument)))
+
+    found = []
+    seen = set()
+    for video in videos:
+        if path.realpath(video) not in seen:
+            seen.add(path.realpath(video))
+            found.append(video)
+    return found
+
+# Returns the name the results of each video are written under (see Analyzer.resetVideo): the name of the
+# video without its extension. Videos of the same name (e.g. from different directories) are told apart with
+# a number, in the order they are given, so their results do not overwrite each other.
+def resultNames(videos):
+    stems = [path.splitext(path.basename(video))[0] for video in videos]
+    names = []
+    used = set()
+    for stem in stems:
+        name = stem
+        count = 2
+        while name in used or (name != stem and name in stems):
+            name = "{}_{}".format(stem, count)
             count += 1
-
-            # Uncomment to remove the cropped images from being saved.
-            # try:
-            #     os.remove(str(frame))
-            # except:
-            #     pass
-            
-
-    # return to folder above.
-    os.chdir("../")
-    return framecount
-
-def main():
+        used.add(name)
+        names.append(name)
+    return names
+
+# Estimates the memory used while analysing a video with the settings of "analyzer", from its resolution and
+# the frames held in flight: those queued by the threaded pipeline (see PIPELINE_THREADS), or else the frame
+# being analysed and the one being decoded.
+def videoMemory(filename, workers, analyzer):
+    video = cv2.VideoCapture(filename)
+    frame_bytes = int(video.get(cv2.CAP_PROP_FRAME_WIDTH)) * int(video.get(cv2.CAP_PROP_FRAME_HEIGHT)) * 3
+    video.release()
+    in_flight = 2
+    if analyzer.PIPELINE_THREADS > 0:
+        in_flight = 2 * analyzer.PIPELINE_QUEUE + analyzer.PIPELINE_THREADS + 2
+    return workers * (PROCESS_MEMORY + in_flight * frame_bytes)
+
+# Analyses several videos in a pool of processes. Videos are started in order as long as the CPU
+# budget (one CPU per worker process) and the memory budget allow; one video is always allowed to run.
+# Returns the summaries of the videos, in the order they were given.
+def runBatch(videos, filter, settings, jobs, workers, cpus, memory, resume=False):
+    summaries = {}
+    running = {}
+    pending = list(zip(videos, resultNames(videos)))
+    analyzer = Analyzer(**settings)
+
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        while pending or running:
+            cpu_used = len(running) * workers
+            memory_used = sum(running.values())
+
+            while pending and len(running) < jobs:
+                needed = videoMemory(pending[0][0], workers, analyzer)
+                if running and (cpu_used + workers > cpus or memory_used + needed > memory):
+                    break
+                filename, name = pending.pop(0)
+                future = executor.submit(batchTask, (filename, name, filter, workers, resume, settings))
+                running[future] = needed
+                cpu_used += workers
+                memory_used += needed
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                summary = future.result()
+                summaries[summary["video"]] = summary
+                print("Finished {} ({}).".format(summary["video"], summary["status"]))
+
+    return [summaries[filename] for filename in videos]
+
+def printSummary(summaries):
+    print()
+    print("{:<40} {:>10} {:>10} {:>10}  {}".format("Video", "Frames", "Seconds", "Frames/s", "Status"))
+    for summary in summaries:
+        rate = summary["frames"] / summary["seconds"] if summary["seconds"] > 0 else 0.0
+        print("{:<40} {:>10} {:>10.1f} {:>10.1f}  {}".format(
+            summary["video"], summary["frames"], summary["seconds"], rate, summary["status"]))
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(description="Extract dosimeter RGB values from one or more videos.")
+    parser.add_argument("videos", nargs="*", help="video files, directories or glob patterns; prompts for a video when omitted")
+    parser.add_argument("--live", metavar="SOURCE",
+        help="analyse a live source instead: a camera index (e.g. 0), a pipe or a stream URL")
+    parser.add_argument("--rate", type=float, default=LIVE_RATE, help="live readings per second (default: 1)")
+    parser.add_argument("--latency", type=float, default=LIVE_LATENCY,
+        help="live latency budget in seconds, from capturing a frame to writing its reading (default: 0.5)")
+    parser.add_argument("--replay", action="store_true",
+        help="read the live source no faster than its frame rate, to replay a video file as a camera")
+    parser.add_argument("--duration", type=float, default=0, help="seconds to run in live mode (default: until Ctrl+C)")
+    parser.add_argument("--mode", choices=["all", "filtered", "adaptive"], default="filtered",
+        help="analyse every frame, only the frames of every 10th second, or more frames where the colour changes faster (default: filtered)")
+    parser.add_argument("--step", type=float, default=ADAPTIVE_STEP,
+        help="adaptive mode: seconds between readings while the colour is stable (default: 1)")
+    parser.add_argument("--threshold", type=int, default=ADAPTIVE_THRESHOLD,
+        help="adaptive mode: change of any channel between readings above which the frames in between are read (default: 4)")
+    parser.add_argument("--offset", type=float, default=TIME_OFFSET, help="seconds skipped at the start of each video")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="directory in which the <video>_results folders are created")
+    parser.add_argument("--jobs", type=int, default=None, help="number of videos analysed concurrently (default: CPU budget)")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="processes used for each video")
+    parser.add_argument("--format", default=",".join(RESULT_FORMATS),
+        help="comma separated result formats: csv, columns, stats (default: csv)")
+    parser.add_argument("--interval", type=float, default=AGGREGATE_SECONDS,
+        help="seconds of frames summarised by each row of the stats format (default: 1)")
+    parser.add_argument("--decoder", choices=["opencv", "ffmpeg"], default=DECODE_BACKEND,
+        help="decode with OpenCV, or pipe cropped frames out of ffmpeg (default: opencv)")
+    parser.add_argument("--dosimeters", type=int, default=DOSIMETERS,
+        help="number of dosimeters in each frame, read in one pass with an R, G, B column group each (default: 1)")
+    parser.add_argument("--calibrate", action="store_true",
+        help="when the dosimeter is not found, calibrate the rgb and size thresholds on frames spread over the video")
+    parser.add_argument("--calibration", default=CALIBRATION_FILE, metavar="FILE",
+        help="file the calibrated thresholds are saved to, and loaded from when it exists")
+    parser.add_argument("--resume", action="store_true",
+        help="continue each video from its last checkpoint, if the video and settings are unchanged")
+    parser.add_argument("--cache", default=ROI_CACHE_DIR,
+        help="directory of the cropped region cache; later runs only repeat the sampling (default: no cache)")
+    parser.add_argument("--cache-budget", type=int, default=ROI_CACHE_BUDGET // (1024 * 1024),
+        help="disk space in MB the region cache may use before old entries are removed")
+    parser.add_argument("--metrics", action="store_true",
+        help="print the throughput while analysing and write <video>_metrics.json and <video>.prom with the stage timings")
+    parser.add_argument("--cpus", type=int, default=os.cpu_count(), help="total number of CPUs the batch may use")
+    parser.add_argument("--memory", type=int, default=4096, help="total memory in MB the batch may use")
+    return parser.parse_args(argv)
+
+# Interactive entry point; prompts for a single video and the data choice.
+def interactive():
     # Get file name to be analyzed
     print("Please enter the filename of the .mp4 file to be analyzed: ")
     filename = str(input())
@@ -404,16 +1922,13 @@ def main():
         print("Please enter the filename of the .mp4 file to be analyzed: ")
         filename = str(input())
 
-    # rsplit() returns an array, split on the delimiter passed in
-    # Here, it splits the ".mp4" off of the video file
-    # (Ex: "test.123.mp4" becomes ["test.123", "mp4"])
-    global vid_name, video_length
-    vid_name = filename.rsplit('.',1)[0]
+    global video_length
     
-    # Get video length in minutes/seconds for frame iteration purposes
-    video = moviepy.editor.VideoFileClip(filename)
-    video_length = int(video.duration)
-    minutes, seconds = convertTime(video_length)
+    # Get video length in seconds from the video itself.
+    video = cv2.VideoCapture(filename)
+    _, _, duration = Analyzer().probeVideo(video, filename)
+    video.release()
+    video_length = int(duration)
 
     # Extract the frames from the video file
     print("Would you like to get all data of the file, or a filtered set of data?")
@@ -429,27 +1944,71 @@ def main():
         print("Enter '1' for all data, or enter '2' for filtered data: ")
         choice = int(input())
 
-    # Initialize the dosimeter size for the given video.
-    if (initDosSize(filename) == False):
-        print("Was unable to determine dosimeter from provided video. Please modify the rgb or size thresholds based on the origin image")
+    # Call getTheFrames to parse the video, called "filename", into individual frames
+    print("Fetching frames. This may take some time, please wait...")
+
+    summary = Analyzer().analyzeVideo(filename, choice == 2)
+    if summary["status"] != "ok":
         print("Terminating the program...")
         sys.exit(1)
+    print("Successfully exported %d frames." % summary["frames"])
+
+# Returns the result formats selected on the command line; exits on an unknown format.
+def resultFormats(args):
+    formats = args.format.split(",")
+    for name in formats:
+        if name not in sinks.FORMATS:
+            print("Error: Unknown result format {}.".format(name))
+            sys.exit(1)
+    if "stats" in formats and args.interval <= 0:
+        print("Error: --interval must be more than 0 seconds.")
+        sys.exit(1)
+    return formats
+
+# Returns the settings of the thresholds saved in the --calibration file, if it exists.
+def calibratedSettings(args):
+    if (args.calibration == "" or not path.exists(args.calibration)):
+        return {}
+    print("Using the thresholds calibrated in {}.".format(args.calibration))
+    return calibration.loadParameters(args.calibration)
+
+# Live entry point: python3 remask.py --live SOURCE [--rate N] [--latency SECONDS] [--replay] [--duration SECONDS]
+def live(args):
+    analyzer = Analyzer(OUTPUT_DIR=args.output_dir, RESULT_FORMATS=resultFormats(args), INSTRUMENT=args.metrics,
+        LIVE_RATE=args.rate, LIVE_LATENCY=args.latency, DOSIMETERS=args.dosimeters, AGGREGATE_SECONDS=args.interval,
+        **calibratedSettings(args))
+    summary = analyzer.analyzeLive(args.live, args.replay, args.duration)
+    if summary["status"] != "ok":
+        print("Live capture failed: {}.".format(summary["status"]))
+        sys.exit(1)
 
-    # Initialize the sample points based off the size of the dosimeter.
-    initSamples()
-
-    # Calculate the baseline rgb values for the origin frame.
-    global base_rgb
-    base_r, base_g, base_b = sampleColor("Origin_cropped.jpg", baseline)
-    base_rgb = [base_r, base_g, base_b]
-
-    print(base_rgb)
-
-    # Call getTheFrames to parse the video, called "filename", into individual frames
-    print("Fetching frames. This may take some time, please wait...")
+# Usage: python3 remask.py [videos, directories or globs] [--mode all|filtered|adaptive] [--offset SECONDS]
+#        [--output-dir DIR] [--jobs N] [--workers N] [--cpus N] [--memory MB]
+# Without any videos, the program prompts for a single video instead.
+def main(argv=None):
+    args = parseArguments(argv)
+    if args.live is not None:
+        live(args)
+        return
+    if not args.videos:
+        interactive()
+        return
+
+    videos = findVideos(args.videos)
+    if not videos:
+        print("Error: No videos found.")
+        sys.exit(1)
 
-    count = getTheFrames(filename, choice)
-    print("Successfully exported %d frames." % count)
+    settings = {"TIME_OFFSET": args.offset, "OUTPUT_DIR": args.output_dir, "RESULT_FORMATS": resultFormats(args),
+        "ROI_CACHE_DIR": args.cache, "ROI_CACHE_BUDGET": args.cache_budget * 1024 * 1024, "INSTRUMENT": args.metrics,
+        "DECODE_BACKEND": args.decoder, "ADAPTIVE": args.mode == "adaptive", "ADAPTIVE_STEP": args.step,
+        "ADAPTIVE_THRESHOLD": args.threshold, "AUTO_CALIBRATE": args.calibrate, "CALIBRATION_FILE": args.calibration,
+        "DOSIMETERS": args.dosimeters, "AGGREGATE_SECONDS": args.interval}
+    settings.update(calibratedSettings(args))
+    jobs = args.jobs or max(args.cpus // args.workers, 1)
+    summaries = runBatch(videos, args.mode == "filtered", settings, jobs, args.workers,
+        args.cpus, args.memory * 1024 * 1024, args.resume)
+    printSummary(summaries)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
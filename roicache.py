@@ -0,0 +1,140 @@
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+# Cache of the cropped dosimeter regions of a video, so the video can be sampled again (e.g. with other
+# sample points) without decoding it or searching for the dosimeter again.
+# Each entry is a folder named after a key (a hash of the video and the detection settings) holding:
+#   rois.bin:   the regions of every analysed frame, zero-padded to one (height, width, 3) canvas.
+#   frames.bin: the frame index of every region (int64).
+#   sizes.bin:  the real (height, width) of every region (int32); (0, 0) when the dosimeter was not found.
+#   origin.npy: the cropped origin frame, from which the baseline is sampled.
+#   meta.json:  the canvas shape, the number of regions, whether the entry is complete, when it was
+#               last used, and the values written by the caller (e.g. the locked dosimeter size).
+# The .bin files are only appended to, so they can be memory-mapped with the row count in meta.json.
+
+def entryDir(cache_dir, key):
+    return os.path.join(cache_dir, key)
+
+def readMeta(directory):
+    with open(os.path.join(directory, "meta.json")) as meta_file:
+        return json.load(meta_file)
+
+def writeMeta(directory, meta):
+    temporary = os.path.join(directory, "meta.json.tmp")
+    with open(temporary, "w") as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(temporary, os.path.join(directory, "meta.json"))
+
+# Writes the regions of a video into a new cache entry, in frame order.
+class CacheWriter:
+    def __init__(self, cache_dir, key, canvas, origin, values, chunk_size=64):
+        self.directory = entryDir(cache_dir, key)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory)
+
+        self.canvas = tuple(canvas)
+        self.chunk_size = chunk_size
+        self.count = 0
+        self.pending = []
+        self.meta = {"key": key, "canvas": list(self.canvas), "rows": 0, "complete": False,
+            "last_used": time.time(), "values": values}
+
+        np.save(os.path.join(self.directory, "origin.npy"), origin)
+        self.files = {name: open(os.path.join(self.directory, name + ".bin"), "wb") for name in ("rois", "frames", "sizes")}
+        writeMeta(self.directory, self.meta)
+
+    # Adds the region of the frame "index"; ROI is None when the dosimeter was not found.
+    def write(self, index, ROI):
+        self.pending.append((index, ROI))
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        height, width = self.canvas
+        rois = np.zeros((len(self.pending), height, width, 3), dtype=np.uint8)
+        sizes = np.zeros((len(self.pending), 2), dtype=np.int32)
+        for i, (_, ROI) in enumerate(self.pending):
+            if ROI is not None:
+                ROI = ROI[:height, :width]
+                rois[i, : ROI.shape[0], : ROI.shape[1]] = ROI
+                sizes[i] = ROI.shape[:2]
+
+        self.files["rois"].write(rois.tobytes())
+        self.files["frames"].write(np.array([index for index, _ in self.pending], dtype=np.int64).tobytes())
+        self.files["sizes"].write(sizes.tobytes())
+        for cache_file in self.files.values():
+            cache_file.flush()
+
+        self.count += len(self.pending)
+        self.pending = []
+        self.meta["rows"] = self.count
+        writeMeta(self.directory, self.meta)
+
+    # Closes the entry; only complete entries are used by later runs.
+    def close(self, complete=True):
+        self.flush()
+        for cache_file in self.files.values():
+            cache_file.close()
+        self.meta["complete"] = complete
+        writeMeta(self.directory, self.meta)
+
+# Opens a complete cache entry and marks it as used; returns None when there is none.
+# The entry holds its metadata, the cropped origin frame and the memory-mapped frames, sizes and regions.
+def loadEntry(cache_dir, key):
+    directory = entryDir(cache_dir, key)
+    try:
+        meta = readMeta(directory)
+    except (OSError, ValueError):
+        return None
+    if not meta["complete"]:
+        return None
+
+    meta["last_used"] = time.time()
+    writeMeta(directory, meta)
+
+    rows = meta["rows"]
+    height, width = meta["canvas"]
+    entry = {"meta": meta, "origin": np.load(os.path.join(directory, "origin.npy"))}
+    if rows == 0:
+        entry["frames"] = np.zeros(0, dtype=np.int64)
+        entry["sizes"] = np.zeros((0, 2), dtype=np.int32)
+        entry["rois"] = np.zeros((0, height, width, 3), dtype=np.uint8)
+        return entry
+
+    entry["frames"] = np.memmap(os.path.join(directory, "frames.bin"), dtype=np.int64, mode="r", shape=(rows,))
+    entry["sizes"] = np.memmap(os.path.join(directory, "sizes.bin"), dtype=np.int32, mode="r", shape=(rows, 2))
+    entry["rois"] = np.memmap(os.path.join(directory, "rois.bin"), dtype=np.uint8, mode="r", shape=(rows, height, width, 3))
+    return entry
+
+def entrySize(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+# Removes cache entries until the cache fits in "budget" bytes. Incomplete entries (from interrupted
+# runs) go first, then the least recently used ones. The entry "keep" is never removed.
+def evict(cache_dir, budget, keep=None):
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for key in os.listdir(cache_dir):
+        directory = entryDir(cache_dir, key)
+        if not os.path.isdir(directory) or key == keep:
+            continue
+        try:
+            meta = readMeta(directory)
+            order = (meta["complete"], meta["last_used"])
+        except (OSError, ValueError, KeyError):
+            order = (False, 0)
+        entries.append((order, directory))
+
+    total = sum(entrySize(entryDir(cache_dir, key)) for key in os.listdir(cache_dir) if os.path.isdir(entryDir(cache_dir, key)))
+    for _, directory in sorted(entries):
+        if total <= budget:
+            break
+        total -= entrySize(directory)
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,349 @@
+import csv # Writing to CSV file
+import json
+import os
+
+import numpy as np
+
+# Result sinks receive the rows produced for each analysed frame. A row is
+# [frame index, minute, second, frame, r, g, b], with r, g and b set to -1 when the dosimeter was
+# not found. With several dosimeters, the row holds an r, g, b group per dosimeter, and "base_rgb" the
+# baseline values of each dosimeter in turn. Rows are buffered and handed to the backend in chunks of
+# "chunk_size" rows.
+# checkpoint() writes out the buffered rows, syncs them to disk, so they survive a power loss or a reboot, and
+# returns the position of the output; a sink opened with that position as "resume" discards anything written
+# after it and appends from there. checkResume raises a ValueError when the output is shorter than the
+# position, e.g. when it did not reach the disk before the machine went down.
+# The time of a frame is its index over "rate", or its timestamp in "times" for a video with a variable frame rate.
+class ResultSink:
+    def __init__(self, base_rgb, rate, chunk_size, times=None):
+        self.base_rgb = list(base_rgb)
+        self.dosimeters = len(self.base_rgb) // 3
+        self.rate = rate
+        self.times = times
+        self.chunk_size = chunk_size
+        self.rows = []
+
+    # Returns the time in seconds of an array of frame indices.
+    def seconds(self, indices):
+        if self.times is None:
+            return indices / self.rate
+        return np.where(indices < len(self.times), self.times[np.minimum(indices, len(self.times) - 1)], indices / self.rate)
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writeChunk(self.rows)
+            self.rows = []
+
+    def close(self):
+        self.flush()
+
+    def checkpoint(self):
+        self.flush()
+        self.sync()
+        return self.position()
+
+    def writeChunk(self, rows):
+        raise NotImplementedError
+
+    def sync(self):
+        raise NotImplementedError
+
+    def position(self):
+        raise NotImplementedError
+
+    @staticmethod
+    def checkResume(filename, position):
+        if not os.path.exists(filename) or os.path.getsize(filename) < position["size"]:
+            raise ValueError("{} is shorter than its checkpoint".format(filename))
+
+# The original CSV output: the baseline values, followed by one Minute, Second, Frame, R, G, B row per frame.
+# With several dosimeters, the R, G, B columns are numbered: R1, G1, B1, R2, G2, B2 and so on.
+class CsvSink(ResultSink):
+    def __init__(self, filename, base_rgb, rate, chunk_size=256, resume=None, times=None):
+        ResultSink.__init__(self, base_rgb, rate, chunk_size, times)
+        if resume is not None:
+            self.checkResume(filename, resume)
+            os.truncate(filename, resume["size"])
+            self.file = open(filename, "a")
+            self.writer = csv.writer(self.file, delimiter=",", quotechar="|", quoting=csv.QUOTE_MINIMAL)
+            return
+
+        self.file = open(filename, "w")
+        self.writer = csv.writer(self.file, delimiter=",", quotechar="|", quoting=csv.QUOTE_MINIMAL)
+        channels = ["R", "G", "B"]
+        if self.dosimeters > 1:
+            channels = ["{}{}".format(channel, i + 1) for i in range(self.dosimeters) for channel in channels]
+        self.writer.writerow(["Baseline RGB values:"] + channels)
+        self.writer.writerow([""] + self.base_rgb)
+        self.writer.writerow(["Minute", "Second", "Frame"] + channels)
+
+    def writeChunk(self, rows):
+        self.writer.writerows(row[1:] for row in rows)
+        self.file.flush()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+
+    def position(self):
+        return {"size": self.file.tell()}
+
+    def close(self):
+        ResultSink.close(self)
+        self.file.close()
+
+# Typed columns written to a directory, one raw little-endian file per column plus columns.json,
+# which holds the dtype and shape of every column and the number of rows written so far.
+# With several dosimeters, the detected, rgb and baseline columns hold a value per dosimeter, e.g. rgb has a
+# (dosimeters, 3) shape (see columnShapes).
+# The column files are only ever appended to, and columns.json is replaced after each chunk has been
+# written, so readers may memory-map the first "rows" rows (see loadColumns) while a run is in progress.
+COLUMNS = [
+    ("frame", "<i8", ()),        # Frame index in the video.
+    ("time", "<f8", ()),         # Timestamp of the frame in seconds.
+    ("detected", "u1", ()),      # 1 when the dosimeter was found in the frame.
+    ("rgb", "u1", (3,)),         # Mean test region RGB; 0 when the dosimeter was not found.
+    ("baseline", "u1", (3,)),    # Baseline RGB of the video.
+]
+
+# Returns the (name, dtype, shape) of the columns written for "dosimeters" dosimeters.
+def columnShapes(dosimeters):
+    if dosimeters <= 1:
+        return COLUMNS
+    return [(name, dtype, shape if name in ("frame", "time") else (dosimeters,) + shape) for name, dtype, shape in COLUMNS]
+
+class ColumnarSink(ResultSink):
+    def __init__(self, directory, base_rgb, rate, chunk_size=4096, resume=None, times=None):
+        ResultSink.__init__(self, base_rgb, rate, chunk_size, times)
+        self.directory = directory
+        self.count = 0
+        self.columns = columnShapes(self.dosimeters)
+        os.makedirs(directory, exist_ok=True)
+
+        if resume is not None:
+            self.checkResume(directory, resume, self.columns)
+        self.files = {}
+        for name, dtype, shape in self.columns:
+            filename = os.path.join(directory, name + ".bin")
+            if resume is not None:
+                os.truncate(filename, resume["rows"] * np.dtype(dtype).itemsize * int(np.prod(shape)))
+                self.files[name] = open(filename, "ab")
+            else:
+                self.files[name] = open(filename, "wb")
+
+        if resume is not None:
+            self.count = resume["rows"]
+        self.writeHeader(complete=False)
+
+    def writeChunk(self, rows):
+        data = np.array(rows, dtype=np.int64).reshape(-1, 4 + 3 * self.dosimeters)
+        rgb = data[:, 4:].reshape(-1, self.dosimeters, 3)
+        detected = rgb[:, :, 0] >= 0
+        columns = {
+            "frame": data[:, 0],
+            "time": self.seconds(data[:, 0]),
+            "detected": detected,
+            "rgb": np.where(detected[:, :, None], rgb, 0),
+            "baseline": np.tile(np.reshape(self.base_rgb, (1, -1, 3)), (len(data), 1, 1)),
+        }
+        for name, dtype, shape in self.columns:
+            self.files[name].write(np.ascontiguousarray(columns[name], dtype=dtype).reshape((len(data),) + shape).tobytes())
+            self.files[name].flush()
+
+        self.count += len(data)
+        self.writeHeader(complete=False)
+
+    def writeHeader(self, complete):
+        header = {
+            "rows": self.count,
+            "rate": self.rate,
+            "complete": complete,
+            "columns": {name: {"dtype": dtype, "shape": list(shape)} for name, dtype, shape in self.columns},
+        }
+        temporary = os.path.join(self.directory, "columns.json.tmp")
+        with open(temporary, "w") as header_file:
+            json.dump(header, header_file)
+        os.replace(temporary, os.path.join(self.directory, "columns.json"))
+
+    def sync(self):
+        for column in self.files.values():
+            os.fsync(column.fileno())
+
+    def position(self):
+        return {"rows": self.count}
+
+    @staticmethod
+    def checkResume(directory, position, columns=COLUMNS):
+        for name, dtype, shape in columns:
+            filename = os.path.join(directory, name + ".bin")
+            if not os.path.exists(filename) or os.path.getsize(filename) < position["rows"] * np.dtype(dtype).itemsize * int(np.prod(shape)):
+                raise ValueError("{} is shorter than its checkpoint".format(filename))
+
+    def close(self):
+        ResultSink.close(self)
+        for column in self.files.values():
+            column.close()
+        self.writeHeader(complete=True)
+
+# Memory-maps the columns written by a ColumnarSink; returns a dictionary of read-only arrays holding
+# the rows written so far.
+def loadColumns(directory):
+    with open(os.path.join(directory, "columns.json")) as header_file:
+        header = json.load(header_file)
+
+    columns = {}
+    for name, column in header["columns"].items():
+        shape = (header["rows"],) + tuple(column["shape"])
+        if header["rows"] == 0:
+            columns[name] = np.zeros(shape, dtype=column["dtype"])
+        else:
+            columns[name] = np.memmap(os.path.join(directory, name + ".bin"), dtype=column["dtype"], mode="r", shape=shape)
+    return columns
+
+# Statistics of every "interval" seconds of rows, written as CSV instead of one row per frame: the first and
+# last frame index, the number of frames, and for each dosimeter the number of frames it was missed in and
+# the mean, standard deviation (of the sample, 0 for a single frame), minimum and maximum of each channel
+# over the frames it was found in. Every row counts toward the statistics, which are kept as running counts,
+# means and sums of squared differences (merged chunk by chunk with the parallel form of Welford's
+# algorithm), so memory does not grow with the length of the interval. Rows must arrive in frame order.
+class StatsSink(ResultSink):
+    def __init__(self, filename, base_rgb, rate, chunk_size=256, resume=None, interval=1.0, times=None):
+        ResultSink.__init__(self, base_rgb, rate, chunk_size, times)
+        self.interval = interval
+        self.current = None
+        if resume is not None:
+            self.checkResume(filename, resume)
+            os.truncate(filename, resume["size"])
+            self.file = open(filename, "a")
+            self.writer = csv.writer(self.file, delimiter=",", quotechar="|", quoting=csv.QUOTE_MINIMAL)
+            if resume["current"] is not None:
+                self.current = {name: np.array(value) if isinstance(value, list) else value for name, value in resume["current"].items()}
+            return
+
+        self.file = open(filename, "w")
+        self.writer = csv.writer(self.file, delimiter=",", quotechar="|", quoting=csv.QUOTE_MINIMAL)
+        channels = ["R", "G", "B"]
+        if self.dosimeters > 1:
+            channels = ["{}{}".format(channel, i + 1) for i in range(self.dosimeters) for channel in channels]
+        self.writer.writerow(["Baseline RGB values:"] + channels)
+        self.writer.writerow([""] + self.base_rgb)
+
+        header = ["Start (s)", "First frame", "Last frame", "Frames"]
+        for i in range(self.dosimeters):
+            header.append("Misses" if self.dosimeters == 1 else "Misses{}".format(i + 1))
+            for channel in channels[3 * i : 3 * i + 3]:
+                header += [channel + " mean", channel + " std", channel + " min", channel + " max"]
+        self.writer.writerow(header)
+
+    # Returns the statistics of the rows of one interval, in the form kept for the current interval.
+    def intervalStats(self, number, data):
+        values = data[:, 4:].astype(np.float64)
+        found = values >= 0
+        count = found.sum(axis=0)
+        mean = np.where(found, values, 0).sum(axis=0) / np.maximum(count, 1)
+        return {
+            "interval": number,
+            "first": int(data[0, 0]),
+            "last": int(data[-1, 0]),
+            "frames": len(data),
+            "count": count,
+            "mean": mean,
+            "m2": np.where(found, (values - mean) ** 2, 0).sum(axis=0),
+            "min": np.where(found, values, np.inf).min(axis=0),
+            "max": np.where(found, values, -np.inf).max(axis=0),
+        }
+
+    # Merges the statistics of more rows of the current interval into it.
+    def merge(self, other):
+        current = self.current
+        count = current["count"] + other["count"]
+        delta = other["mean"] - current["mean"]
+        current["m2"] = current["m2"] + other["m2"] + delta ** 2 * current["count"] * other["count"] / np.maximum(count, 1)
+        current["mean"] = current["mean"] + delta * other["count"] / np.maximum(count, 1)
+        current["count"] = count
+        current["min"] = np.minimum(current["min"], other["min"])
+        current["max"] = np.maximum(current["max"], other["max"])
+        current["last"] = other["last"]
+        current["frames"] += other["frames"]
+
+    def writeInterval(self, stats):
+        row = [round(float(stats["interval"] * self.interval), 3), stats["first"], stats["last"], stats["frames"]]
+        std = np.sqrt(stats["m2"] / np.maximum(stats["count"] - 1, 1))
+        for i in range(self.dosimeters):
+            row.append(stats["frames"] - int(stats["count"][3 * i]))
+            for c in range(3 * i, 3 * i + 3):
+                if stats["count"][c] == 0:
+                    row += ["", "", "", ""]
+                else:
+                    row += [round(stats["mean"][c], 2), round(std[c], 2), int(stats["min"][c]), int(stats["max"][c])]
+        self.writer.writerow(row)
+
+    def writeChunk(self, rows):
+        data = np.array(rows, dtype=np.int64).reshape(-1, 4 + 3 * self.dosimeters)
+        numbers = np.floor(self.seconds(data[:, 0]) / self.interval).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, numbers[1:] != numbers[:-1]])
+        for start, end in zip(starts, np.r_[starts[1:], len(data)]):
+            stats = self.intervalStats(int(numbers[start]), data[start : end])
+            if self.current is not None and self.current["interval"] == stats["interval"]:
+                self.merge(stats)
+                continue
+            if self.current is not None:
+                self.writeInterval(self.current)
+            self.current = stats
+        self.file.flush()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+
+    # The statistics of the current interval are part of the position, as they have not been written yet.
+    def position(self):
+        current = None
+        if self.current is not None:
+            current = {name: value.tolist() if isinstance(value, np.ndarray) else value for name, value in self.current.items()}
+        return {"size": self.file.tell(), "current": current}
+
+    def close(self):
+        ResultSink.close(self)
+        if self.current is not None:
+            self.writeInterval(self.current)
+            self.current = None
+        self.file.close()
+
+# Result formats which may be selected, and the name of their output next to <vid_name>.
+FORMATS = {
+    "csv": (CsvSink, ".csv"),
+    "columns": (ColumnarSink, "_columns"),
+    "stats": (StatsSink, "_stats.csv"),
+}
+
+# Opens a sink for each of the requested formats; "prefix" is the output path without extension.
+# "resume" optionally holds the checkpointed position of each format to continue from,
+# "chunk_size" overrides the number of rows each sink buffers (1 writes every row out at once) and
+# "interval" sets the seconds summarised by each row of the "stats" format and "times" holds the timestamps
+# of the frames of a video with a variable frame rate.
+def openSinks(formats, prefix, base_rgb, rate, resume=None, chunk_size=None, interval=None, times=None):
+    sinks = []
+    for name in formats:
+        sink_class, suffix = FORMATS[name]
+        position = resume[name] if resume is not None else None
+        options = {"times": times}
+        if chunk_size is not None:
+            options["chunk_size"] = chunk_size
+        if sink_class is StatsSink and interval is not None:
+            options["interval"] = interval
+        sinks.append(sink_class(prefix + suffix, base_rgb, rate, resume=position, **options))
+    return sinks
+
+# Raises a ValueError when the output of any of the formats is shorter than its checkpointed position in
+# "resume" (see openSinks); "dosimeters" is the number of dosimeters the columns hold values for.
+def checkResume(formats, prefix, resume, dosimeters=1):
+    for name in formats:
+        sink_class, suffix = FORMATS[name]
+        if sink_class is ColumnarSink:
+            ColumnarSink.checkResume(prefix + suffix, resume[name], columnShapes(dosimeters))
+        else:
+            sink_class.checkResume(prefix + suffix, resume[name])